@@ -0,0 +1,132 @@
+"""
+Bitsliced evaluation of HDL netlists
+
+Every wire holds a Python int whose bit k is the wire's value in test
+vector (lane) k, so each Nand gate computes all lanes with one
+mask ^ (a & b). The chip's sorted Nand gates are compiled into one
+straight-line function over local variables. Built-in memories cannot
+be sliced this way, since each lane would read its own address, so
+the RAM chips are simulated gate by gate here
+"""
+
+from hdl_netlist import FALSE, TRUE, Chip, ChipLibrary
+from hdl_parser import HDLError
+
+
+def pack(values, bits):
+    """
+    Returns bits slices holding values, one lane per value
+    """
+
+    values = list(values)
+    return [int(''.join('1' if value >> bit & 1 else '0' for value in reversed(values)) or '0', 2)
+            for bit in range(bits)]
+
+
+def unpack(slices, lanes):
+    """
+    Returns the value of each of lanes lanes held in slices
+    """
+
+    values = [0] * lanes
+    for bit, lane_bits in enumerate(slices):
+        weight = 1 << bit
+        text = format(lane_bits, 'b')[::-1]
+        lane = text.find('1')
+        while lane >= 0:
+            values[lane] |= weight
+            lane = text.find('1', lane + 1)
+    return values
+
+
+def exhaustive(bits, start=0, lanes=None):
+    """
+    Returns slices of bits bits whose lanes count up from start, by
+    default through every value of bits bits
+    """
+
+    lanes = 1 << bits if lanes is None else lanes
+    slices = []
+    for bit in range(bits):
+        period = 1 << bit + 1
+        unit = max(period, 8)
+        if start % unit == 0 and lanes % unit == 0:
+            # whole units: repeat the bytes of a run of zeros then ones
+            block = ((1 << (1 << bit)) - 1) << (1 << bit)
+            block = sum(block << period * k for k in range(unit // period))
+            pattern = block.to_bytes(unit // 8, 'little') * (lanes // unit)
+            slices.append(int.from_bytes(pattern, 'little'))
+        else:
+            slices.append(pack(range(start, start + lanes), bit + 1)[bit])
+    return slices
+
+
+def compile_schedule(netlist, name='evaluate'):
+    """
+    Returns a function evaluating the netlist's Nand gates on a list
+    of wire values and a lane mask
+    """
+
+    reads = set()
+    writes = set()
+    lines = []
+    for nands, memory in netlist.schedule:
+        if memory is not None:
+            raise HDLError(f'built-in {memory.name} cannot be bitsliced')
+        for a, b, out in nands:
+            reads.update((a, b))
+            writes.add(out)
+            lines.append(f'    w{out} = mask ^ (w{a} & w{b})')
+
+    loads = [f'    w{wire} = values[{wire}]' for wire in sorted(reads - writes)]
+    stores = [f'    values[{wire}] = w{wire}' for wire in sorted(writes)]
+    source = '\n'.join([f'def {name}(values, mask):'] + loads + lines + stores + ['    pass'])
+    namespace = {}
+    exec(compile(source, f'<bitsliced {name}>', 'exec'), namespace)
+    return namespace[name]
+
+
+class BitslicedChip:
+    """
+    Chip simulator over lanes test vectors at once, with the same
+    set/get/eval/tick/tock interface as Chip but slices for values;
+    set_values and get_values pack and unpack plain integers
+    """
+
+    def __init__(self, chip, lanes, library=None):
+        if isinstance(chip, str):
+            chip = Chip(chip, library if library is not None else ChipLibrary(behavioral=False))
+        self.chip = chip
+        self.lanes = lanes
+        self.mask = (1 << lanes) - 1
+        self.pins = chip.pins
+        self.function = compile_schedule(chip.netlist, chip.definition.name)
+        self.values = [0] * len(chip.values)
+        self.values[TRUE] = self.mask
+        self.latched = [0] * len(chip.netlist.dffs)
+
+    def set(self, pin, slices):
+        for wire, lane_bits in zip(self.pins[pin], slices):
+            self.values[wire] = lane_bits & self.mask
+
+    def get(self, pin):
+        return [self.values[wire] for wire in self.pins[pin]]
+
+    def set_values(self, pin, values):
+        self.set(pin, pack(values, len(self.pins[pin])))
+
+    def get_values(self, pin):
+        return unpack(self.get(pin), self.lanes)
+
+    def eval(self):
+        self.values[FALSE] = 0
+        self.function(self.values, self.mask)
+
+    def tick(self):
+        self.eval()
+        self.latched = [self.values[data] for data, _ in self.chip.netlist.dffs]
+
+    def tock(self):
+        for (_, out), lane_bits in zip(self.chip.netlist.dffs, self.latched):
+            self.values[out] = lane_bits
+        self.eval()
@@ -0,0 +1,65 @@
+import marshal
+import os
+import tempfile
+from array import array
+
+from hdl_netlist import Template
+
+
+class NetlistCache:
+    """
+    On-disk cache of flattened chip templates
+    Entries are files named chip.key.netlist, keyed by ChipLibrary.key,
+    which hashes a chip's .hdl with the keys of all its parts; storing
+    a chip's template removes its entries under older keys, so editing
+    one .hdl only rebuilds it and the chips that use it
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name, key):
+        return os.path.join(self.directory, f'{name}.{key[:16]}.netlist')
+
+    def fetch(self, name, key):
+        """
+        Returns the cached Template of chip name, or None
+        """
+
+        try:
+            with open(self.path(name, key), 'rb') as infile:
+                fields = marshal.load(infile)
+        except (FileNotFoundError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+
+        name, wire_count, pins, nands, dffs, memories, registers, warnings = fields
+        self.hits += 1
+        return Template(name, wire_count, pins, array('I', nands), array('I', dffs),
+                        memories, registers, warnings)
+
+    def store(self, name, key, template):
+        """
+        Writes template under key and removes the chip's stale entries
+        The entry is written to a temporary file and renamed into place,
+        so concurrent runs never see a partial entry
+        """
+
+        path = self.path(name, key)
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outfile:
+            marshal.dump((template.name, template.wire_count, template.pins,
+                          template.nands.tobytes(), template.dffs.tobytes(),
+                          template.memories, template.registers, template.warnings), outfile)
+        os.replace(tmppath, path)
+
+        for entry in os.scandir(self.directory):
+            if (entry.name.startswith(name + '.') and entry.name.endswith('.netlist')
+                    and entry.path != path and entry.name.count('.') == 2):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+from hdl_cache import NetlistCache
+from hdl_netlist import ChipLibrary
+from hdl_parser import HDLError
+from hdl_test import TestScript
+
+
+def find_scripts(path):
+    """
+    Expands a .tst file, a directory searched recursively or a glob
+    """
+
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '**', '*.tst'), recursive=True))
+    elif glob.has_magic(path):
+        return sorted(glob.glob(path, recursive=True))
+    else:
+        return [path]
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='HDL chip simulator running .tst scripts')
+    argparser.add_argument('paths', nargs='+', help='.tst files, directories or glob patterns')
+    argparser.add_argument('--hdl', action='append', default=[], metavar='DIR',
+                           help='also look for chips in DIR')
+    argparser.add_argument('--cache', metavar='DIR',
+                           help='keep flattened netlists in DIR and reuse those of unchanged chips')
+    argparser.add_argument('--gates', action='store_true',
+                           help='simulate the RAM chips gate by gate instead of as arrays')
+    args = argparser.parse_args()
+
+    cache = NetlistCache(args.cache) if args.cache else None
+    failures = 0
+    for path in [script for path in args.paths for script in find_scripts(path)]:
+        start = time.perf_counter()
+        library = ChipLibrary([os.path.dirname(os.path.abspath(path))] + args.hdl,
+                              behavioral=not args.gates, cache=cache)
+        script = TestScript(path, library)
+        try:
+            lines = script.run()
+        except (HDLError, OSError) as error:
+            failures += 1
+            print(f'FAIL {path}: {error}')
+            continue
+        finally:
+            for warning in script.chip.warnings if script.chip else []:
+                print(f'warning: {warning}')
+        print(f'ok   {path}: {lines} lines in {time.perf_counter() - start:.2f} s')
+
+    if cache is not None:
+        print(f'cache: {cache.hits} hits, {cache.misses} misses')
+    sys.exit(1 if failures else 0)
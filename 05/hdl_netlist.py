@@ -0,0 +1,562 @@
+"""
+Gate-level simulation of HDL chips
+
+A chip is elaborated into a flat netlist: every bit of every pin and
+internal bus becomes a wire index, every part bottoms out in Nand gates,
+DFFs and the built-in memories (ROM32K, Screen, Keyboard, and the RAM
+chips unless they are simulated gate by gate), and wires connected
+through pins are merged with union-find. Each chip type is flattened
+once into a Template over its own wire numbering, which every instance
+of it copies with its wires renumbered, and which a NetlistCache can
+keep on disk. The combinational part is then sorted topologically once,
+so evaluating the chip is a single pass over precomputed wire indices
+"""
+
+import glob
+import hashlib
+import os
+from array import array
+from collections import defaultdict, namedtuple
+
+from hdl_parser import ChipDef, HDLError, parse_file
+
+
+FALSE = 0
+TRUE = 1
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# chips with no .hdl of their own; parts is None
+BUILTIN_CHIPS = {
+    'Nand': ChipDef('Nand', [('a', 1), ('b', 1)], [('out', 1)], None),
+    'DFF': ChipDef('DFF', [('in', 1)], [('out', 1)], None),
+    'ROM32K': ChipDef('ROM32K', [('address', 15)], [('out', 16)], None),
+    'Screen': ChipDef('Screen', [('in', 16), ('load', 1), ('address', 13)], [('out', 16)], None),
+    'Keyboard': ChipDef('Keyboard', [], [('out', 16)], None),
+}
+
+# array-backed stand-ins for the projects' RAM chips
+BEHAVIORAL_CHIPS = {
+    name: ChipDef(name, [('in', 16), ('load', 1), ('address', bits)], [('out', 16)], None)
+    for name, bits in [('RAM8', 3), ('RAM64', 6), ('RAM512', 9), ('RAM4K', 12), ('RAM16K', 14)]
+}
+
+# bump whenever a change here changes the templates built
+NETLIST_VERSION = '2'
+
+# built-in chips that behave exactly like one of the projects' chips
+ALIASES = {
+    'ARegister': 'Register',
+    'DRegister': 'Register',
+}
+
+# parts whose out pin scripts read as Name[] or Name[0] wherever they
+# are nested, as the CPU's registers are in Computer
+REGISTER_CHIPS = ('ARegister', 'DRegister', 'PC', 'Register')
+
+
+def project_directories():
+    """
+    Returns the directories of the projects holding .hdl files
+    """
+
+    paths = glob.glob(os.path.join(PROJECT_ROOT, '[0-9][0-9]', '**', '*.hdl'), recursive=True)
+    return sorted({os.path.dirname(path) for path in paths})
+
+
+# a chip flattened over its own wires: 0 and 1 are false and true, the
+# pins map to wire lists, nands and dffs are flat arrays of (a, b, out)
+# and (in, out) triples and pairs, memories (name, address, in, load,
+# out) tuples with load None if there is none, and registers maps the
+# REGISTER_CHIPS parts at any depth to the wires of their out pins
+Template = namedtuple('Template', ('name', 'wire_count', 'pins', 'nands', 'dffs', 'memories',
+                                   'registers', 'warnings'))
+
+
+def bits_value(values, wires):
+    value = 0
+    for bit, wire in enumerate(wires):
+        value |= values[wire] << bit
+    return value
+
+
+def set_bits(values, wires, value):
+    for bit, wire in enumerate(wires):
+        values[wire] = value >> bit & 1
+
+
+class ChipLibrary:
+    """
+    Loads chip definitions by name, from the built-in chips or from
+    .hdl files in the given directories and then the projects' own
+    If behavioral, the RAM chips are array-backed memories wherever
+    they are used as parts; flattened templates are also looked up in
+    and added to cache (a NetlistCache) if one is given
+    """
+
+    def __init__(self, directories=(), behavioral=True, cache=None):
+        self.directories = list(directories) + project_directories()
+        self.behavioral = behavioral
+        self.cache = cache
+        self.definitions = {}
+        self.paths = {}
+        self.templates = {}
+        self.keys = {}
+
+    def definition(self, name):
+        """
+        Returns the chip's own definition, from its .hdl if it has one
+        """
+
+        name = ALIASES.get(name, name)
+        if name not in self.definitions:
+            if name in BUILTIN_CHIPS:
+                self.definitions[name] = BUILTIN_CHIPS[name]
+            else:
+                for directory in self.directories:
+                    path = os.path.join(directory, name + '.hdl')
+                    if os.path.exists(path):
+                        self.definitions[name] = parse_file(path)
+                        self.paths[name] = path
+                        break
+                else:
+                    if name not in BEHAVIORAL_CHIPS:
+                        raise HDLError(f'no chip named {name}')
+                    self.definitions[name] = BEHAVIORAL_CHIPS[name]
+        return self.definitions[name]
+
+    def get(self, name):
+        """
+        Returns the definition used for name as a part
+        """
+
+        name = ALIASES.get(name, name)
+        if self.behavioral and name in BEHAVIORAL_CHIPS:
+            return BEHAVIORAL_CHIPS[name]
+        return self.definition(name)
+
+    def key(self, name):
+        """
+        Hashes the chip's source together with the keys of its parts, so
+        a change to any chip changes the keys of the chips using it
+        """
+
+        chip = self.get(name)
+        if chip.name not in self.keys:
+            digest = hashlib.sha256()
+            digest.update(f'{NETLIST_VERSION}\0{chip.name}\0{self.behavioral}\0'.encode())
+            if chip.parts is None:
+                digest.update(b'builtin')
+            else:
+                with open(self.paths[chip.name], 'rb') as infile:
+                    digest.update(infile.read())
+                for part in sorted({part.chip for part in chip.parts}):
+                    digest.update(b'\0' + self.key(part).encode())
+            self.keys[chip.name] = digest.hexdigest()
+        return self.keys[chip.name]
+
+    def template(self, name):
+        """
+        Returns the flattened Template of the chip used for name as a
+        part, building it (and its parts') at most once
+        """
+
+        chip = self.get(name)
+        if chip.name not in self.templates:
+            template = None
+            if self.cache is not None and chip.parts is not None:
+                template = self.cache.fetch(chip.name, self.key(chip.name))
+            if template is None:
+                template = build_template(self, chip)
+                if self.cache is not None and chip.parts is not None:
+                    self.cache.store(chip.name, self.key(chip.name), template)
+            self.templates[chip.name] = template
+        return self.templates[chip.name]
+
+
+def builtin_template(chip):
+    """
+    Returns the Template of a built-in chip
+    """
+
+    pins = {}
+    wire_count = 2
+    for name, width in chip.inputs + chip.outputs:
+        pins[name] = list(range(wire_count, wire_count + width))
+        wire_count += width
+
+    nands = array('I')
+    dffs = array('I')
+    memories = []
+    if chip.name == 'Nand':
+        nands.extend(pins['a'] + pins['b'] + pins['out'])
+    elif chip.name == 'DFF':
+        dffs.extend(pins['in'] + pins['out'])
+    else:
+        load = pins['load'][0] if 'load' in pins else None
+        memories.append((chip.name, pins.get('address', []), pins.get('in', []), load, pins['out']))
+    return Template(chip.name, wire_count, pins, nands, dffs, memories, {}, [])
+
+
+def build_template(library, chip):
+    """
+    Flattens chip over its own wires
+    """
+
+    if chip.parts is None:
+        return builtin_template(chip)
+
+    netlist = Netlist()
+    pins = {pin: netlist.new_wires(width) for pin, width in chip.inputs + chip.outputs}
+    netlist.elaborate(library, chip, pins)
+    return netlist.template(chip.name, pins)
+
+
+class Memory:
+    """
+    Built-in memory of 2 ** len(address) words, read combinationally
+    and written on the clock while load is set
+    """
+
+    def __init__(self, name, address, data_in, load, out):
+        self.name = name
+        self.address = address
+        self.data_in = data_in
+        self.load = load
+        self.out = out
+        self.words = [0] * (1 << len(address))
+        self.pending = None
+
+    def remap(self, find):
+        self.address = [find(wire) for wire in self.address]
+        self.data_in = [find(wire) for wire in self.data_in]
+        self.load = None if self.load is None else find(self.load)
+        self.out = [find(wire) for wire in self.out]
+
+    def read(self, values):
+        set_bits(values, self.out, self.words[bits_value(values, self.address)])
+
+    def latch(self, values):
+        if self.load is not None and values[self.load]:
+            self.pending = bits_value(values, self.address), bits_value(values, self.data_in)
+
+    def commit(self):
+        if self.pending is not None:
+            address, word = self.pending
+            self.words[address] = word
+            self.pending = None
+
+
+class Netlist:
+    """
+    Nand gates as (a, b, out), DFFs as (in, out) and memories over
+    wire indices; wires 0 and 1 are the constants false and true
+    """
+
+    def __init__(self):
+        self.parent = array('I', [FALSE, TRUE])
+        self.nands = []
+        self.dffs = []
+        self.memories = []
+        # out wires of the first part of each REGISTER_CHIPS type found
+        self.registers = {}
+        self.warnings = []
+        self.warned = set()
+
+    def new_wires(self, count):
+        start = len(self.parent)
+        self.parent.extend(range(start, start + count))
+        return list(range(start, start + count))
+
+    def find(self, wire):
+        parent = self.parent
+        while parent[wire] != wire:
+            parent[wire] = parent[parent[wire]]
+            wire = parent[wire]
+        return wire
+
+    def join(self, first, second):
+        first, second = sorted((self.find(first), self.find(second)))
+        if first == second:
+            return
+        if second <= TRUE:
+            raise HDLError('true and false connected together')
+        self.parent[second] = first
+
+    def bus(self, chip, wires, name, wire_range, width):
+        """
+        Returns the wires of name (or the bits of it in wire_range) in
+        chip, making a new internal bus of width if it is unknown
+        """
+
+        if name in ('true', 'false'):
+            return [TRUE if name == 'true' else FALSE] * width
+        if name not in wires:
+            if wire_range is not None:
+                raise HDLError(f'{chip.name}: sub bus of unknown internal pin {name}')
+            wires[name] = self.new_wires(width)
+
+        bits = wires[name]
+        if wire_range is not None:
+            first, last = wire_range
+            bits = bits[first:last + 1]
+        if len(bits) != width:
+            raise HDLError(f'{chip.name}: {name} is {len(bits)} bits wide where {width} are needed')
+        return bits
+
+    def elaborate(self, library, chip, pins, parts=None):
+        """
+        Adds the gates of chip with its pins connected to the given
+        wires, recording the pins of its parts in parts if given
+        """
+
+        if chip.parts is None:
+            self.instantiate(builtin_template(chip), pins)
+            return
+
+        wires = dict(pins)
+        driven = {name for name, _ in chip.inputs}
+
+        for part in chip.parts:
+            sub = library.get(part.chip)
+            sub_pins = {name: [FALSE] * width for name, width in sub.inputs}
+            outputs = {name: self.new_wires(width) for name, width in sub.outputs}
+            sub_pins.update(outputs)
+
+            for pin, pin_range, wire, wire_range in part.connections:
+                if pin not in sub_pins:
+                    raise HDLError(f'{chip.name}: {part.chip} has no pin {pin}')
+                inner = sub_pins[pin]
+                first, last = pin_range or (0, len(inner) - 1)
+                positions = range(first, last + 1)
+                outer = self.bus(chip, wires, wire, wire_range, len(positions))
+                if pin in outputs:
+                    if wire in ('true', 'false'):
+                        raise HDLError(f'{chip.name}: output {pin} of {part.chip} connected to {wire}')
+                    for position, outer_wire in zip(positions, outer):
+                        self.join(inner[position], outer_wire)
+                    driven.add(wire)
+                else:
+                    for position, outer_wire in zip(positions, outer):
+                        inner[position] = outer_wire
+
+            if part.chip in REGISTER_CHIPS:
+                self.registers.setdefault(part.chip, outputs['out'])
+            self.instantiate(library.template(part.chip), sub_pins)
+            if parts is not None:
+                parts.setdefault(part.chip, sub_pins)
+
+        for name in sorted(set(wires) - driven):
+            self.warn(f'{chip.name}: {name} is never driven')
+
+    def warn(self, warning):
+        if warning not in self.warned:
+            self.warned.add(warning)
+            self.warnings.append(warning)
+
+    def instantiate(self, template, pins):
+        """
+        Copies template's gates in, with its pins on the given wires and
+        fresh wires for everything inside it
+        """
+
+        mapping = [None] * template.wire_count
+        mapping[FALSE] = FALSE
+        mapping[TRUE] = TRUE
+        for name, wires in template.pins.items():
+            for local, wire in zip(wires, pins[name]):
+                if mapping[local] is None:
+                    mapping[local] = wire
+                else:
+                    self.join(mapping[local], wire)
+
+        unmapped = [local for local, wire in enumerate(mapping) if wire is None]
+        for local, wire in zip(unmapped, self.new_wires(len(unmapped))):
+            mapping[local] = wire
+
+        nands = template.nands
+        self.nands.extend(zip([mapping[wire] for wire in nands[0::3]],
+                              [mapping[wire] for wire in nands[1::3]],
+                              [mapping[wire] for wire in nands[2::3]]))
+        dffs = template.dffs
+        self.dffs.extend(zip([mapping[wire] for wire in dffs[0::2]],
+                             [mapping[wire] for wire in dffs[1::2]]))
+        for name, address, data_in, load, out in template.memories:
+            self.memories.append(Memory(name, [mapping[wire] for wire in address],
+                                        [mapping[wire] for wire in data_in],
+                                        None if load is None else mapping[load],
+                                        [mapping[wire] for wire in out]))
+        for name, wires in template.registers.items():
+            self.registers.setdefault(name, [mapping[wire] for wire in wires])
+        for warning in template.warnings:
+            self.warn(warning)
+
+    def template(self, name, pins):
+        """
+        Returns the netlist as a Template of chip name with the given
+        pins, its merged wires numbered from 2 up
+        """
+
+        numbers = {FALSE: FALSE, TRUE: TRUE}
+
+        def number(wire):
+            wire = self.find(wire)
+            if wire not in numbers:
+                numbers[wire] = len(numbers)
+            return numbers[wire]
+
+        pins = {pin: [number(wire) for wire in wires] for pin, wires in pins.items()}
+        nands = array('I', [number(wire) for gate in self.nands for wire in gate])
+        dffs = array('I', [number(wire) for dff in self.dffs for wire in dff])
+        memories = [(memory.name, [number(wire) for wire in memory.address],
+                     [number(wire) for wire in memory.data_in],
+                     None if memory.load is None else number(memory.load),
+                     [number(wire) for wire in memory.out])
+                    for memory in self.memories]
+        registers = {register: [number(wire) for wire in wires]
+                     for register, wires in self.registers.items()}
+        return Template(name, len(numbers), pins, nands, dffs, memories, registers,
+                        list(self.warnings))
+
+    def finish(self):
+        """
+        Resolves merged wires and orders the combinational logic
+        """
+
+        find = self.find
+        self.nands = [(find(a), find(b), find(out)) for a, b, out in self.nands]
+        self.dffs = [(find(data), find(out)) for data, out in self.dffs]
+        for memory in self.memories:
+            memory.remap(find)
+
+        nodes = ([((a, b), (out,), None) for a, b, out in self.nands] +
+                 [(memory.address, memory.out, memory) for memory in self.memories])
+        driver = {}
+        sources = [(out,) for _, out in self.dffs] + [outputs for _, outputs, _ in nodes]
+        for index, outputs in enumerate(sources, -len(self.dffs)):
+            for wire in outputs:
+                if wire in driver or wire <= TRUE:
+                    raise HDLError(f'wire {wire} has more than one driver')
+                driver[wire] = index
+        # DFF outputs (negative indices) start a new cycle, like inputs
+        driver = {wire: index for wire, index in driver.items() if index >= 0}
+
+        readers = defaultdict(list)
+        waiting = []
+        for index, (inputs, _, _) in enumerate(nodes):
+            count = 0
+            for wire in inputs:
+                if wire in driver:
+                    readers[wire].append(index)
+                    count += 1
+            waiting.append(count)
+
+        order = [index for index, count in enumerate(waiting) if count == 0]
+        for index in order:
+            for wire in nodes[index][1]:
+                for reader in readers[wire]:
+                    waiting[reader] -= 1
+                    if waiting[reader] == 0:
+                        order.append(reader)
+        if len(order) < len(nodes):
+            raise HDLError('combinational loop')
+
+        # runs of Nand gates between memory reads
+        self.schedule = [([], None)]
+        for index in order:
+            inputs, outputs, memory = nodes[index]
+            if memory is None:
+                self.schedule[-1][0].append((inputs[0], inputs[1], outputs[0]))
+            else:
+                self.schedule[-1] = (self.schedule[-1][0], memory)
+                self.schedule.append(([], None))
+
+
+class Chip:
+    """
+    Simulator for a chip elaborated from its HDL
+    Inputs are set with set(), outputs read with get(); eval()
+    propagates combinational logic, and tick() / tock() are the rising
+    and falling clock edges at which DFFs and memories update
+    """
+
+    def __init__(self, name, library=None):
+        self.library = library if library is not None else ChipLibrary()
+        self.definition = self.library.definition(name)
+        netlist = self.netlist = Netlist()
+
+        self.pins = {pin: netlist.new_wires(width)
+                     for pin, width in self.definition.inputs + self.definition.outputs}
+        self.parts = {}
+        netlist.elaborate(self.library, self.definition, self.pins, self.parts)
+        netlist.finish()
+
+        for pins in [self.pins, netlist.registers] + list(self.parts.values()):
+            for pin, wires in pins.items():
+                pins[pin] = [netlist.find(wire) for wire in wires]
+
+        self.values = bytearray(len(netlist.parent))
+        self.values[TRUE] = 1
+        self.latched = bytes(len(netlist.dffs))
+        self.eval()
+
+    @property
+    def warnings(self):
+        return self.netlist.warnings
+
+    def width(self, pin):
+        return len(self.pins[pin])
+
+    def set(self, pin, value):
+        if pin not in self.pins:
+            raise HDLError(f'{self.definition.name} has no pin {pin}')
+        set_bits(self.values, self.pins[pin], value)
+
+    def get(self, pin):
+        if pin not in self.pins:
+            raise HDLError(f'{self.definition.name} has no pin {pin}')
+        return bits_value(self.values, self.pins[pin])
+
+    def has_part(self, name):
+        return name in self.parts or name in self.netlist.registers
+
+    def part_value(self, name):
+        """
+        Returns the output of the part named name, as in Register[]: one
+        of the chip's own parts, or a register nested at any depth
+        """
+
+        if name in self.parts:
+            return bits_value(self.values, self.parts[name]['out'])
+        if name in self.netlist.registers:
+            return bits_value(self.values, self.netlist.registers[name])
+        raise HDLError(f'{self.definition.name} has no part {name}')
+
+    def memory(self, name):
+        for memory in self.netlist.memories:
+            if memory.name == name:
+                return memory
+        raise HDLError(f'{self.definition.name} has no built-in memory {name}')
+
+    def eval(self):
+        values = self.values
+        for nands, memory in self.netlist.schedule:
+            for a, b, out in nands:
+                values[out] = 1 ^ (values[a] & values[b])
+            if memory is not None:
+                memory.read(values)
+
+    def tick(self):
+        self.eval()
+        values = self.values
+        self.latched = bytes(values[data] for data, _ in self.netlist.dffs)
+        for memory in self.netlist.memories:
+            memory.latch(values)
+
+    def tock(self):
+        values = self.values
+        for (_, out), value in zip(self.netlist.dffs, self.latched):
+            values[out] = value
+        for memory in self.netlist.memories:
+            memory.commit()
+        self.eval()
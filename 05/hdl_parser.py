@@ -0,0 +1,127 @@
+"""
+Parser for the nand2tetris HDL
+
+A chip definition becomes a ChipDef holding its input and output pins
+as (name, width) pairs and its parts, each a chip name with a list of
+connections. Ranges are inclusive (first, last) bit pairs, or None for
+the whole pin
+"""
+
+import re
+from collections import namedtuple
+
+
+ChipDef = namedtuple('ChipDef', ('name', 'inputs', 'outputs', 'parts'))
+Part = namedtuple('Part', ('chip', 'connections'))
+Connection = namedtuple('Connection', ('pin', 'pin_range', 'wire', 'wire_range'))
+
+
+COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+TOKEN_RE = re.compile(r'\.\.|[A-Za-z_][\w.]*|\d+|[{}()\[\],;=:]|\S')
+
+
+class HDLError(Exception):
+    pass
+
+
+class Parser:
+    def __init__(self, text, path='<hdl>'):
+        self.tokens = TOKEN_RE.findall(COMMENT_RE.sub(' ', text))
+        self.index = 0
+        self.path = path
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def advance(self, expected=None):
+        token = self.peek()
+        if token is None or expected is not None and token != expected:
+            raise HDLError(f'{self.path}: expected {expected or "more input"}, got {token}')
+        self.index += 1
+        return token
+
+    def parse(self):
+        """
+        Returns the ChipDef of the chip; parts is None for a BUILTIN chip
+        """
+
+        self.advance('CHIP')
+        name = self.advance()
+        self.advance('{')
+        inputs = outputs = []
+        if self.peek() == 'IN':
+            self.advance()
+            inputs = self.parse_pins()
+        if self.peek() == 'OUT':
+            self.advance()
+            outputs = self.parse_pins()
+
+        parts = []
+        if self.peek() == 'BUILTIN':
+            parts = None
+            while self.advance() != '}':
+                pass
+            return ChipDef(name, inputs, outputs, parts)
+
+        self.advance('PARTS')
+        self.advance(':')
+        while self.peek() != '}':
+            parts.append(self.parse_part())
+        self.advance('}')
+        return ChipDef(name, inputs, outputs, parts)
+
+    def parse_pins(self):
+        """
+        Returns (name, width) pairs up to the closing semicolon
+        """
+
+        pins = []
+        if self.peek() == ';':
+            self.advance()
+            return pins
+        while True:
+            name = self.advance()
+            width = 1
+            if self.peek() == '[':
+                self.advance()
+                width = int(self.advance())
+                self.advance(']')
+            pins.append((name, width))
+            if self.advance() == ';':
+                return pins
+
+    def parse_part(self):
+        chip = self.advance()
+        self.advance('(')
+        connections = []
+        while True:
+            pin, pin_range = self.parse_bus()
+            self.advance('=')
+            wire, wire_range = self.parse_bus()
+            connections.append(Connection(pin, pin_range, wire, wire_range))
+            if self.advance() == ')':
+                break
+        self.advance(';')
+        return Part(chip, connections)
+
+    def parse_bus(self):
+        """
+        Returns a pin or wire name and its bit range
+        """
+
+        name = self.advance()
+        if self.peek() != '[':
+            return name, None
+        self.advance()
+        first = int(self.advance())
+        last = first
+        if self.peek() == '..':
+            self.advance()
+            last = int(self.advance())
+        self.advance(']')
+        return name, (first, last)
+
+
+def parse_file(path):
+    with open(path, 'r') as infile:
+        return Parser(infile.read(), path).parse()
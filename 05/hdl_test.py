@@ -0,0 +1,225 @@
+"""
+Runner for nand2tetris .tst scripts
+
+Scripts load a chip, set its inputs, clock it and write output lines
+laid out by output-list; each line is compared to the same line of the
+compare-to file as it is written, with '*' matching any character
+"""
+
+import os
+import re
+
+from hdl_netlist import Chip, ChipLibrary
+from hdl_parser import COMMENT_RE, HDLError
+
+
+TOKEN_RE = re.compile(r'"[^"]*"|[{},;!]|[^\s{},;!"]+')
+OUTPUT_RE = re.compile(r'(?P<name>[^%\[]+)(\[(?P<index>\d*)\])?'
+                       r'(%(?P<format>[BDXS])(?P<left>\d+)\.(?P<width>\d+)\.(?P<right>\d+))?')
+CONDITIONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class ComparisonFailure(HDLError):
+    pass
+
+
+def parse_script(tokens):
+    """
+    Returns the commands in tokens up to a closing brace, each a list
+    of words or a ('repeat', count, body) or ('while', words, body)
+    block
+    """
+
+    commands = []
+    words = []
+    while tokens:
+        token = tokens.pop(0)
+        if token in (',', ';', '!'):
+            if words:
+                commands.append(words)
+            words = []
+        elif token == '{':
+            kind, arguments = words[0], words[1:]
+            count = int(arguments[0]) if kind == 'repeat' and arguments else -1
+            commands.append((kind, count if kind == 'repeat' else arguments, parse_script(tokens)))
+            words = []
+        elif token == '}':
+            break
+        else:
+            words.append(token)
+    if words:
+        commands.append(words)
+    return commands
+
+
+def parse_value(text):
+    """
+    Returns the integer value of a script literal such as %B0101,
+    %XFF, %D-3 or 12
+    """
+
+    if text.startswith('%'):
+        base = {'B': 2, 'X': 16, 'D': 10}[text[1].upper()]
+        return int(text[2:], base)
+    return int(text)
+
+
+def matches(line, expected):
+    return len(line) == len(expected) and all(
+        want == '*' or got == want for got, want in zip(line, expected))
+
+
+class TestScript:
+    def __init__(self, path, library=None):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.library = library if library is not None else ChipLibrary([self.directory])
+        self.chip = None
+        self.columns = []
+        self.outfile = None
+        self.expected = None
+        self.lines = 0
+        self.time = 0
+        self.ticked = False
+
+    def run(self):
+        """
+        Runs the script, raising ComparisonFailure at the first output
+        line that differs from the compare file, and returns the number
+        of lines output
+        """
+
+        with open(self.path, 'r') as infile:
+            tokens = TOKEN_RE.findall(COMMENT_RE.sub(' ', infile.read()))
+        try:
+            self.execute(parse_script(tokens))
+        finally:
+            if self.outfile:
+                self.outfile.close()
+        return self.lines
+
+    def execute(self, commands):
+        for command in commands:
+            if isinstance(command, tuple):
+                kind, argument, body = command
+                if kind == 'repeat':
+                    count = 0
+                    while argument < 0 or count < argument:
+                        self.execute(body)
+                        count += 1
+                else:
+                    while self.condition(argument):
+                        self.execute(body)
+            else:
+                self.command(command[0], command[1:])
+
+    def command(self, name, arguments):
+        if name == 'load':
+            chip = arguments[0] if arguments else os.path.basename(self.path)
+            self.chip = Chip(chip.rsplit('.', 1)[0], self.library)
+        elif name == 'output-file':
+            self.outfile = open(os.path.join(self.directory, arguments[0]), 'w')
+        elif name == 'compare-to':
+            with open(os.path.join(self.directory, arguments[0]), 'r') as infile:
+                self.expected = [line.rstrip('\r\n') for line in infile]
+        elif name == 'output-list':
+            self.columns = [OUTPUT_RE.fullmatch(spec) for spec in arguments]
+            self.write(self.header())
+        elif name == 'set':
+            self.set(arguments[0], parse_value(arguments[1]))
+        elif name == 'eval':
+            self.chip.eval()
+        elif name == 'tick':
+            self.chip.tick()
+            self.ticked = True
+        elif name == 'tock':
+            self.chip.tock()
+            self.time += 1
+            self.ticked = False
+        elif name == 'output':
+            self.write(self.row())
+        elif name in ('echo', 'clear-echo', 'breakpoint', 'clear-breakpoints'):
+            pass
+        elif len(arguments) == 2 and arguments[0] == 'load':
+            self.load_memory(name, arguments[1])
+        else:
+            raise HDLError(f'{self.path}: unknown command {name}')
+
+    def load_memory(self, name, filename):
+        with open(os.path.join(self.directory, filename), 'r') as infile:
+            words = [int(line, 2) for line in infile if line.strip()]
+        memory = self.chip.memory(name)
+        memory.words[:len(words)] = words
+
+    def set(self, target, value):
+        match = OUTPUT_RE.fullmatch(target)
+        if match['index']:
+            self.chip.memory(match['name']).words[int(match['index'])] = value & 0xFFFF
+        else:
+            self.chip.set(target, value)
+
+    def value(self, match):
+        """
+        Returns the value of an output-list column and its width in bits
+        """
+
+        name = match['name']
+        if name == 'time':
+            return f'{self.time}+' if self.ticked else str(self.time), 0
+        if match['index'] is None:
+            return self.chip.get(name), self.chip.width(name)
+        if match['index'] == '' or match['index'] == '0' and self.chip.has_part(name):
+            return self.chip.part_value(name), 16
+        return self.chip.memory(name).words[int(match['index'])], 16
+
+    def condition(self, words):
+        name, operator, literal = words
+        value, bits = self.value(OUTPUT_RE.fullmatch(name))
+        if bits == 16 and value & 0x8000:
+            value -= 0x10000
+        return CONDITIONS[operator](value, parse_value(literal))
+
+    def header(self):
+        cells = []
+        for match in self.columns:
+            total = int(match['left'] or 1) + int(match['width'] or 1) + int(match['right'] or 1)
+            name = match.string.split('%')[0][:total]
+            left = (total - len(name)) // 2
+            cells.append(' ' * left + name + ' ' * (total - len(name) - left))
+        return '|' + '|'.join(cells) + '|'
+
+    def row(self):
+        cells = []
+        for match in self.columns:
+            value, bits = self.value(match)
+            kind = match['format'] or 'B'
+            width = int(match['width'] or max(bits, 1))
+            if kind == 'S' or bits == 0:
+                text = str(value)[:width].ljust(width)
+            elif kind == 'D':
+                if bits == 16 and value & 0x8000:
+                    value -= 0x10000
+                text = str(value).rjust(width)
+            elif kind == 'X':
+                text = format(value, f'0{width}X')[-width:]
+            else:
+                text = format(value, f'0{width}b')[-width:]
+            cells.append(' ' * int(match['left'] or 1) + text + ' ' * int(match['right'] or 1))
+        return '|' + '|'.join(cells) + '|'
+
+    def write(self, line):
+        if self.outfile:
+            self.outfile.write(line + '\n')
+        if self.expected is not None:
+            expected = self.expected[self.lines] if self.lines < len(self.expected) else ''
+            if not matches(line, expected):
+                raise ComparisonFailure(f'{self.path}: comparison failure at line {self.lines + 1}: '
+                                        f'expected {expected!r}, got {line!r}')
+        self.lines += 1
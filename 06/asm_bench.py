@@ -0,0 +1,93 @@
+"""
+Microbenchmark for Parser.parse_instr
+
+Generates a .asm corpus (a million lines by default), checks that the
+first-character dispatch gives the same results as trying every pattern
+in TOKEN_RE, and reports lines/sec for both
+
+    python asm_bench.py [nlines]
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from asm_parser import TOKEN_RE, Parser
+from asm_translator import COMP_BIN, DEST_BIN, JUMP_BIN
+
+
+def parse_instr_legacy(cmd):
+    """
+    Parser.parse_instr as it was before first-character dispatch
+    """
+
+    for instr_type in TOKEN_RE:
+        match = re.fullmatch(TOKEN_RE[instr_type], cmd)
+        if match:
+            return instr_type, match.groupdict('')
+
+
+def generate_corpus(path, nlines, seed=0):
+    """
+    Writes nlines of .asm with roughly the instruction mix of
+    translated VM code, plus comments and blank lines
+    """
+
+    rand = random.Random(seed)
+    comps = list(COMP_BIN)
+    dests = list(DEST_BIN)
+    jumps = list(JUMP_BIN)
+
+    with open(path, 'w') as outfile:
+        for index in range(nlines):
+            r = rand.random()
+            if r < 0.40:
+                dest = rand.choice(dests)
+                jump = rand.choice(jumps) if r < 0.05 else ''
+                line = (dest + '=' if dest else '') + rand.choice(comps) + (';' + jump if jump else '')
+            elif r < 0.65:
+                line = '@' + rand.choice(['SP', 'LCL', 'ARG', 'R13', f'Main.{index % 50}', f'label.{index}'])
+            elif r < 0.85:
+                line = '@' + str(rand.randrange(32768))
+            elif r < 0.90:
+                line = f'(label.{index})'
+            elif r < 0.95:
+                line = '// push constant 7'
+            else:
+                line = ''
+            outfile.write('    ' + line + '\n')
+
+
+def time_parse(cmds, parse_instr, repeat=3):
+    """
+    Best of repeat timings of parse_instr over already stripped lines
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed = [parse_instr(cmd) for cmd in cmds]
+        best = min(best, time.perf_counter() - start)
+    return best, parsed
+
+
+if __name__ == '__main__':
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'corpus.asm')
+        generate_corpus(path, nlines)
+        with open(path, 'r') as infile:
+            cmds = [cmd for cmd in map(Parser.strip, infile) if cmd]
+
+    legacy_time, legacy = time_parse(cmds, parse_instr_legacy)
+    dispatch_time, dispatch = time_parse(cmds, Parser.parse_instr)
+    assert legacy == dispatch, 'parse_instr disagrees with TOKEN_RE'
+
+    print(f'{nlines} lines')
+    print(f'TOKEN_RE loop: {nlines / legacy_time:12,.0f} lines/sec')
+    print(f'dispatch:      {nlines / dispatch_time:12,.0f} lines/sec '
+          f'({legacy_time / dispatch_time:.1f}x)')
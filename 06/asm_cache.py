@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+# bump whenever a change to the assembler changes its output
+ASSEMBLER_VERSION = '1'
+
+
+class AssemblyCache:
+    """
+    On-disk cache of assembled programs, keyed by a hash of the source
+    and the assembler version
+    Entries are files named key + extension ('.hack', '.rom',
+    '.hack.map'); their mtimes record last use, and the least recently
+    used keys are evicted, all their files together, once the cache
+    holds more than max_bytes
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, inpath, options=()):
+        """
+        Hashes the source file together with the assembler version and
+        any options that change the output
+        """
+
+        digest = hashlib.sha256()
+        digest.update(ASSEMBLER_VERSION.encode())
+        for option in options:
+            digest.update(b'\0' + str(option).encode())
+        digest.update(b'\0')
+        with open(inpath, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fetch(self, key, outpaths):
+        """
+        Copies cached outputs to outpaths (a dict of extension to path)
+        Returns whether every requested output was in the cache
+        """
+
+        entries = {ext: os.path.join(self.directory, key + ext) for ext in outpaths}
+        try:
+            for ext, entry in entries.items():
+                shutil.copyfile(entry, outpaths[ext])
+                os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def store(self, key, outpaths):
+        """
+        Adds freshly assembled outputs to the cache, then evicts
+        Entries are written to a temporary file and renamed into place,
+        so concurrent workers never see a partial entry
+        """
+
+        for ext, outpath in outpaths.items():
+            fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(outpath, tmppath)
+            os.replace(tmppath, os.path.join(self.directory, key + ext))
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the files of least recently used keys until the cache fits
+        """
+
+        keys = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            key = entry.name.split('.', 1)[0]
+            used, size, paths = keys.get(key, (0, 0, []))
+            keys[key] = max(used, stat.st_mtime), size + stat.st_size, paths + [entry.path]
+
+        total = sum(size for _, size, _ in keys.values())
+        for _, size, paths in sorted(keys.values()):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.evictions += 1
+            total -= size
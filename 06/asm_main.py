@@ -1,26 +1,177 @@
+import argparse
+import glob
 import os
-import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+from asm_cache import AssemblyCache
+from asm_optimizer import Optimizer
 from asm_parser import Parser
+from asm_pipeline import assemble
+from asm_sink import RomSink, StreamSink, TeeSink
+from asm_source_map import SourceMap
 from asm_translator import Translator
 
 
-if __name__ == '__main__':
-    inpath = os.path.abspath(sys.argv[1])
+Result = namedtuple('Result', ('inpath', 'instructions', 'seconds', 'cached', 'saved'))
+
+
+def assemble_file(inpath, single_pass=False, binary=False, optimize=False,
+                  strip_dead=False, cache_dir=None, cache_size=64 * 1024 * 1024,
+                  source_map=False):
+    """
+    Assembles inpath into a .hack file next to it (and a .rom image
+    if binary, a .hack.map source map if source_map), returning a
+    Result with the number of instructions, seconds, whether the
+    outputs came from the cache and the ROM words saved by each
+    optimization pass
+    """
+
+    start = time.perf_counter()
+    optimizer = None
+    if optimize or strip_dead:
+        optimizer = Optimizer(peephole=optimize, dead_code=strip_dead)
     outpath = inpath.split('.')[0] + '.hack'
+    rompath = inpath.split('.')[0] + '.rom'
+
+    outpaths = {'.hack': outpath}
+    if binary:
+        outpaths['.rom'] = rompath
+    mapping = None
+    if source_map:
+        mapping = SourceMap()
+        outpaths['.hack.map'] = outpath + '.map'
+
+    if cache_dir:
+        cache = AssemblyCache(cache_dir, cache_size)
+        key_options = [name for name, enabled in [('optimize', optimize), ('strip-dead', strip_dead),
+                                                  ('source-map', source_map)] if enabled]
+        key = cache.key(inpath, key_options)
+        if cache.fetch(key, outpaths):
+            ninstrs = os.path.getsize(outpath) // 17
+            return Result(inpath, ninstrs, time.perf_counter() - start, True, {})
+
+    if binary:
+        with open(inpath, 'r') as infile, open(outpath, 'w') as outfile, \
+                open(rompath, 'wb') as romfile:
+            sink = TeeSink(StreamSink(outfile), RomSink(romfile))
+            translator = assemble(infile, sink, optimizer, mapping, os.path.basename(inpath))
+            sink.close()
+
+    elif single_pass:
+        with open(inpath, 'r') as infile, open(outpath, 'w') as outfile:
+            translator = assemble(infile, StreamSink(outfile), optimizer,
+                                  mapping, os.path.basename(inpath))
+
+    else:
+        with open(inpath, 'r') as infile:
+            lines = infile.readlines()
+            parser = Parser(lines)
+
+        parser.parse(numbered=source_map)
+        if optimizer:
+            parser.parsed = optimizer.run(parser.parsed)
+
+        with open(outpath, 'w') as outfile:
+            translator = Translator(StreamSink(outfile), mapping, os.path.basename(inpath))
+
+            for instr_type, kwargs in parser.parsed:
+                translator.assign_label_address(instr_type, kwargs)
+
+            for instr_type, kwargs in parser.parsed:
+                translator.assign_symbol_address(instr_type, kwargs)
+
+    if mapping is not None:
+        with open(outpath + '.map', 'w') as mapfile:
+            mapping.write(mapfile)
 
-    with open(inpath, 'r') as infile:
-        lines = infile.readlines()
-        parser = Parser(lines)
+    if cache_dir:
+        cache.store(key, outpaths)
 
-    parser.parse()
-    translator = Translator()
+    saved = optimizer.saved if optimizer else {}
+    return Result(inpath, translator.next_rom_address, time.perf_counter() - start, False, saved)
 
-    for instr_type, kwargs in parser.parsed:
-        translator.assign_label_address(instr_type, kwargs)
 
-    for instr_type, kwargs in parser.parsed:
-        translator.assign_symbol_address(instr_type, kwargs)
+def find_inputs(path):
+    """
+    Expands a file, a directory of .asm files or a glob pattern
+    """
+
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.asm')))
+    elif glob.has_magic(path):
+        return sorted(glob.glob(path, recursive=True))
+    else:
+        return [path]
+
+
+def assemble_batch(inpaths, jobs=None, **options):
+    """
+    Assembles many files across a process pool, reporting each file's
+    time and the aggregate throughput
+    """
+
+    start = time.perf_counter()
+    total = 0
+    hits = 0
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(assemble_file, inpath, **options) for inpath in inpaths]
+        for future in futures:
+            result = future.result()
+            total += result.instructions
+            hits += result.cached
+            print(f'{result.inpath}: {result.instructions} instructions '
+                  f'in {result.seconds * 1000:.1f} ms'
+                  + (' (cached)' if result.cached else '')
+                  + ''.join(f', {name} saved {words}' for name, words in result.saved.items()))
+
+    elapsed = time.perf_counter() - start
+    print(f'{len(inpaths)} files, {total} instructions in {elapsed:.2f} s '
+          f'({len(inpaths) / elapsed:.1f} files/s, {total / elapsed:,.0f} instructions/s)')
+
+    if options.get('cache_dir'):
+        print_cache_stats(hits, len(inpaths) - hits)
+
+
+def print_cache_stats(hits, misses):
+    print(f'cache: {hits} hits, {misses} misses '
+          f'({100 * hits / ((hits + misses) or 1):.0f}% hit rate)')
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Hack assembler')
+    argparser.add_argument('path', help='.asm file, directory of .asm files or glob pattern')
+    argparser.add_argument('--single-pass', action='store_true',
+                           help='stream through the single-pass pipeline')
+    argparser.add_argument('--binary', action='store_true',
+                           help='also write a raw little-endian .rom image')
+    argparser.add_argument('--jobs', type=int, default=None,
+                           help='worker processes for batch mode (default: all CPUs)')
+    argparser.add_argument('--optimize', action='store_true',
+                           help='run the peephole optimizer before resolving labels')
+    argparser.add_argument('--strip-dead', action='store_true',
+                           help='strip code that cannot be reached from address 0')
+    argparser.add_argument('--cache', metavar='DIR',
+                           help='reuse outputs of unchanged sources from this directory')
+    argparser.add_argument('--cache-size', type=int, default=64 * 1024 * 1024,
+                           help='bytes kept in the cache before evicting (default: 64 MiB)')
+    argparser.add_argument('--source-map', action='store_true',
+                           help='also write a .hack.map from ROM addresses to .asm lines')
+    args = argparser.parse_args()
+
+    inpaths = [os.path.abspath(inpath) for inpath in find_inputs(args.path)]
+    options = {'single_pass': args.single_pass, 'binary': args.binary,
+               'optimize': args.optimize, 'strip_dead': args.strip_dead,
+               'cache_dir': args.cache, 'cache_size': args.cache_size,
+               'source_map': args.source_map}
 
-    with open(outpath, 'w') as outfile:
-        outfile.write(translator.translated)
+    if len(inpaths) == 1 and inpaths[0] == os.path.abspath(args.path):
+        result = assemble_file(inpaths[0], **options)
+        for name, words in result.saved.items():
+            print(f'{name}: saved {words} ROM words')
+        if args.cache:
+            print_cache_stats(int(result.cached), int(not result.cached))
+    else:
+        assemble_batch(inpaths, jobs=args.jobs, **options)
@@ -0,0 +1,202 @@
+"""
+Optimization passes over parsed instruction lists, run before labels
+are resolved so that removing instructions cannot break any address
+
+Instructions are (instr_type, kwargs) pairs as produced by asm_parser
+Passes only rely on labels for jump targets, so programs that jump to
+numeric ROM addresses are left untouched
+"""
+
+
+def a_operand(instr):
+    """
+    Returns what an A-instruction loads into A, or None otherwise
+    """
+
+    instr_type, kwargs = instr
+    if instr_type == 'a-symbol':
+        return kwargs['symbol']
+    elif instr_type == 'a-decimal':
+        return int(kwargs['value'])
+
+
+def is_c(instr, dest=None, comp=None, jump=None):
+    """
+    Whether instr is a C-instruction with the given fields
+    """
+
+    instr_type, kwargs = instr
+    return (instr_type == 'c' and
+            (dest is None or kwargs['dest'] == dest) and
+            (comp is None or kwargs['comp'] == comp) and
+            (jump is None or kwargs['jump'] == jump))
+
+
+def jumps_to_numeric_address(instrs):
+    """
+    Whether any jump targets an address loaded by a decimal A-instruction
+    """
+
+    numeric = False
+    for instr_type, kwargs in instrs:
+        if instr_type == 'a-decimal':
+            numeric = True
+        elif instr_type == 'a-symbol' or instr_type == 'l':
+            numeric = False
+        elif kwargs['jump'] and numeric:
+            return True
+        elif 'A' in kwargs['dest']:
+            numeric = False
+    return False
+
+
+class Optimizer:
+    """
+    Runs the enabled passes over a parsed program and records how many
+    ROM words each one saved
+    """
+
+    def __init__(self, peephole=True, dead_code=False):
+        self.peephole = peephole
+        self.dead_code = dead_code
+        self.saved = {}
+
+    def run(self, instrs):
+        instrs = list(instrs)
+        if jumps_to_numeric_address(instrs):
+            return instrs
+
+        if self.dead_code:
+            instrs = self.run_pass('dead code', eliminate_dead_code, instrs)
+
+        if self.peephole:
+            instrs = self.run_pass('peephole', peephole, instrs)
+
+        return instrs
+
+    def run_pass(self, name, optimize, instrs):
+        before = sum(instr_type != 'l' for instr_type, _ in instrs)
+        instrs = optimize(instrs)
+        after = sum(instr_type != 'l' for instr_type, _ in instrs)
+        self.saved[name] = self.saved.get(name, 0) + before - after
+        return instrs
+
+
+def peephole(instrs):
+    """
+    Rewrites redundant sequences until none are left:
+    1. @SP / M=M+1 / @SP / AM=M-1 (push then pop) becomes @SP / A=M
+    2. A-instructions reloading the value A already holds are dropped;
+       what A holds is forgotten at every label, so only straight-line
+       code is affected
+    3. A jump with no destination to the label that follows it is dropped,
+       with its A-instruction too if the next instruction reloads A
+    """
+
+    while True:
+        optimized = peephole_pass(instrs)
+        if len(optimized) == len(instrs):
+            return optimized
+        instrs = optimized
+
+
+def peephole_pass(instrs):
+    out = []
+    known_a = None
+    index = 0
+    # a label defined more than once resolves to its last definition
+    last_definitions = {kwargs['symbol']: index for index, (instr_type, kwargs)
+                        in enumerate(instrs) if instr_type == 'l'}
+
+    while index < len(instrs):
+        instr = instrs[index]
+        window = instrs[index:index + 4]
+
+        if (len(window) == 4 and a_operand(window[0]) == 'SP' and
+                is_c(window[1], 'M', 'M+1', '') and a_operand(window[2]) == 'SP' and
+                is_c(window[3], 'AM', 'M-1', '')):
+            emit = [window[0], ('c', {'dest': 'A', 'comp': 'M', 'jump': ''})]
+            index += 4
+
+        elif (len(window) >= 3 and a_operand(instr) is not None and
+                is_c(window[1], dest='') and window[1][1]['jump'] and
+                jumps_to_label_ahead(instrs, index + 2, a_operand(instr), last_definitions)):
+            after_labels = index + 2
+            while after_labels < len(instrs) and instrs[after_labels][0] == 'l':
+                after_labels += 1
+            reloads_a = (after_labels < len(instrs) and
+                         a_operand(instrs[after_labels]) is not None)
+            emit = [] if reloads_a else [instr]
+            index += 2
+
+        else:
+            emit = [instr]
+            index += 1
+
+        for instr in emit:
+            operand = a_operand(instr)
+            if operand is not None:
+                if operand == known_a:
+                    continue
+                known_a = operand
+            elif instr[0] == 'l' or 'A' in instr[1]['dest']:
+                known_a = None
+            out.append(instr)
+
+    return out
+
+
+def jumps_to_label_ahead(instrs, index, label, last_definitions):
+    """
+    Whether label resolves to one of the labels starting at index
+    """
+
+    while index < len(instrs) and instrs[index][0] == 'l':
+        if last_definitions.get(label) == index:
+            return True
+        index += 1
+    return False
+
+
+def eliminate_dead_code(instrs):
+    """
+    Strips basic blocks that cannot be reached from address 0
+    Blocks start at labels and after jumps; a block leads to the next
+    one unless it ends in an unconditional jump, and to every label it
+    loads with an A-instruction, which covers direct jumps as well as
+    return addresses pushed for an indirect jump later
+    """
+
+    starts = []
+    for index, (instr_type, kwargs) in enumerate(instrs):
+        after_jump = index > 0 and is_c(instrs[index - 1]) and instrs[index - 1][1]['jump']
+        starts_label_run = instr_type == 'l' and (index == 0 or instrs[index - 1][0] != 'l')
+        if index == 0 or after_jump or starts_label_run:
+            starts.append(index)
+    ends = starts[1:] + [len(instrs)]
+
+    # a label defined more than once resolves to its last definition
+    label_blocks = {}
+    for block, (start, end) in enumerate(zip(starts, ends)):
+        for instr_type, kwargs in instrs[start:end]:
+            if instr_type == 'l':
+                label_blocks[kwargs['symbol']] = block
+
+    reachable = {0} if instrs else set()
+    stack = list(reachable)
+    while stack:
+        block = stack.pop()
+        start, end = starts[block], ends[block]
+        successors = []
+        if not is_c(instrs[end - 1], jump='JMP') and block + 1 < len(starts):
+            successors.append(block + 1)
+        for instr in instrs[start:end]:
+            if a_operand(instr) in label_blocks:
+                successors.append(label_blocks[a_operand(instr)])
+        for successor in successors:
+            if successor not in reachable:
+                reachable.add(successor)
+                stack.append(successor)
+
+    return [instr for block in sorted(reachable)
+            for instr in instrs[starts[block]:ends[block]]]
@@ -9,16 +9,22 @@ TOKEN_RE = {
 }
 
 
+# TOKEN_RE folded into one pattern; alternatives are tried in the same order
+INSTR_RE = re.compile(
+    r"@(?P<value>[\d]+)"
+    r"|@(?P<a_symbol>.+)"
+    r"|\((?P<l_symbol>.+)\)"
+    r"|((?P<dest>.+)=)?(?P<comp>[^;=]+)(;(?P<jump>[A-Z]+))?"
+)
+
+
 class Parser:
     def __init__(self, lines):
         self.lines = lines
         self.parsed = []
 
-    def parse(self):
-        for line in self.lines:
-            cmd = self.strip(line)
-            if cmd:
-                self.parsed.append(self.parse_instr(cmd))
+    def parse(self, numbered=False):
+        self.parsed.extend((parse_numbered_lines if numbered else parse_lines)(self.lines))
 
     @staticmethod
     def strip(line):
@@ -29,9 +35,65 @@ class Parser:
         """
         Returns instruction type and dictionary of symbols, labels, 
         and variables for a line of the program
+        Dispatches on the first character and splits well-formed
+        instructions without a regex; anything else goes through INSTR_RE
         """
-        
-        for instr_type in TOKEN_RE:
-            match = re.fullmatch(TOKEN_RE[instr_type], cmd)
-            if match:
-                return instr_type, match.groupdict('')
+
+        first = cmd[:1]
+        if first == '@':
+            value = cmd[1:]
+            if '\n' not in value:
+                if value.isdecimal():
+                    return 'a-decimal', {'value': value}
+                elif value:
+                    return 'a-symbol', {'symbol': value}
+        elif first == '(':
+            if cmd[-1] == ')' and len(cmd) > 2 and '\n' not in cmd:
+                return 'l', {'symbol': cmd[1:-1]}
+        elif '\n' not in cmd:
+            dest, eq, comp = cmd.rpartition('=')
+            comp, semi, jump = comp.partition(';')
+            if (comp and (dest or not eq) and
+                    (not semi or jump.isascii() and jump.isalpha() and jump.isupper())):
+                return 'c', {'dest': dest, 'comp': comp, 'jump': jump}
+
+        match = INSTR_RE.fullmatch(cmd)
+        if not match:
+            return None
+        elif match['value'] is not None:
+            return 'a-decimal', {'value': match['value']}
+        elif match['a_symbol'] is not None:
+            return 'a-symbol', {'symbol': match['a_symbol']}
+        elif match['l_symbol'] is not None:
+            return 'l', {'symbol': match['l_symbol']}
+        else:
+            return 'c', {'dest': match['dest'] or '',
+                         'comp': match['comp'],
+                         'jump': match['jump'] or ''}
+
+
+def parse_lines(lines):
+    """
+    Yields instruction type and dictionary for each line holding an
+    instruction, reading lines lazily from any iterable (e.g. a file)
+    """
+
+    for line in lines:
+        cmd = Parser.strip(line)
+        if cmd:
+            yield Parser.parse_instr(cmd)
+
+
+def parse_numbered_lines(lines):
+    """
+    Like parse_lines, also recording the 1-based source line of each
+    instruction in its dictionary under 'line'
+    """
+
+    for number, line in enumerate(lines, 1):
+        cmd = Parser.strip(line)
+        if cmd:
+            instr = Parser.parse_instr(cmd)
+            if instr:
+                instr[1]['line'] = number
+            yield instr
@@ -0,0 +1,69 @@
+"""
+Streaming assembler, one generator stage per step:
+
+    parse_lines -> collect_labels -> encode -> write
+
+assemble_instrs starts after parsing, for instructions that never
+were text
+
+Lines are read lazily, so only the symbol table and the translator's
+compact buffer (one 32-bit word per instruction) stay in memory
+"""
+
+from asm_parser import parse_lines, parse_numbered_lines
+from asm_translator import Translator
+
+
+def collect_labels(instrs, translator):
+    """
+    Records label addresses and buffers every other instruction,
+    then yields the buffer as (word, symbol) pairs once all labels
+    are known
+    """
+
+    for instr_type, kwargs in instrs:
+        translator.translate(instr_type, kwargs)
+
+    yield from translator.drain()
+
+
+def encode(buffered, translator):
+    """
+    Fills holes with resolved addresses and yields instruction words
+    """
+
+    for word, symbol in buffered:
+        if symbol is not None:
+            word = translator.resolve_symbol(symbol)
+        yield word
+
+
+def write(words, sink):
+    for word in words:
+        sink.write(word)
+
+
+def assemble(lines, sink, optimizer=None, source_map=None, source_name=None):
+    """
+    Assembles an iterable of .asm lines into sink
+    ROM addresses are mapped to source_name lines in source_map if given
+    """
+
+    instrs = parse_lines(lines) if source_map is None else parse_numbered_lines(lines)
+    return assemble_instrs(instrs, sink, optimizer, source_map, source_name)
+
+
+def assemble_instrs(instrs, sink, optimizer=None, source_map=None, source_name=None):
+    """
+    Assembles already parsed (instr_type, kwargs) pairs into sink, e.g.
+    those of the VM translator, skipping the text round trip
+    An optimizer needs the whole program, so it materializes the
+    instructions as a list before labels are collected
+    Only instructions with a 'line' are mapped in source_map
+    """
+
+    translator = Translator(sink, source_map, source_name)
+    if optimizer:
+        instrs = optimizer.run(instrs)
+    write(encode(collect_labels(instrs, translator), translator), sink)
+    return translator
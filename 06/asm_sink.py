@@ -0,0 +1,90 @@
+import sys
+from array import array
+
+
+def format_word(word):
+    return format(word, '016b') + '\n'
+
+
+class ListSink:
+    """
+    Collects instruction words in an array('H'), formatted as .hack
+    text only when asked for
+    """
+
+    def __init__(self):
+        self.words = array('H')
+
+    def write(self, word):
+        self.words.append(word)
+
+    def getvalue(self):
+        return ''.join(map(format_word, self.words))
+
+    def close(self):
+        pass
+
+
+class StreamSink:
+    """
+    Writes .hack lines through to a text stream, so nothing is kept in
+    memory when streaming to disk; only a stream that keeps its text,
+    like io.StringIO, can give it back through getvalue
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, word):
+        self.stream.write(format_word(word))
+
+    def getvalue(self):
+        if not hasattr(self.stream, 'getvalue'):
+            raise TypeError(f'{self.stream!r} does not keep the text written to it; '
+                            'write to an io.StringIO or a ListSink to read it back')
+        return self.stream.getvalue()
+
+    def close(self):
+        pass
+
+
+class RomSink(ListSink):
+    """
+    Collects instruction words and writes them to a binary stream as a
+    raw little-endian 16-bit ROM image on close, so a simulator can load
+    the program with a single read
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def close(self):
+        words = array('H', self.words)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        self.stream.write(words.tobytes())
+
+
+class TeeSink:
+    """
+    Writes every word to each of several sinks
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, word):
+        for sink in self.sinks:
+            sink.write(word)
+
+    def getvalue(self):
+        """
+        Returns the text of the first sink, if it keeps it
+        """
+
+        return self.sinks[0].getvalue()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,123 @@
+"""
+Source maps
+
+A source map sends keys (ROM addresses, or line numbers of a generated
+.asm file) to (file, line) pairs in the source they came from. Each
+entry covers the keys from its own up to the next entry's, so runs of
+keys with the same source cost one entry. The sidecar format is plain
+text, one entry per line in key order:
+
+    hack-source-map 1
+    file Prog.asm
+    0 3
+    1 4
+
+and lookups bisect the keys, or walk a sorted stream of keys in step
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+HEADER = 'hack-source-map 1'
+
+
+class SourceMap:
+    def __init__(self):
+        self.keys = array('I')
+        self.lines = array('I')
+        self.file_ids = array('H')
+        self.files = []
+        self.file_ids_by_name = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, filename, line):
+        """
+        Maps key (and the keys after it) to filename:line; keys must be
+        added in increasing order
+        """
+
+        file_id = self.file_ids_by_name.get(filename)
+        if file_id is None:
+            file_id = self.file_ids_by_name[filename] = len(self.files)
+            self.files.append(filename)
+        if self.keys and self.file_ids[-1] == file_id and self.lines[-1] == line:
+            return
+        self.keys.append(key)
+        self.lines.append(line)
+        self.file_ids.append(file_id)
+
+    def lookup(self, key):
+        """
+        Returns (filename, line) for key, or None if key comes before
+        the first entry
+        """
+
+        index = bisect_right(self.keys, key) - 1
+        if index < 0:
+            return None
+        return self.files[self.file_ids[index]], self.lines[index]
+
+    def lookup_sorted(self, keys):
+        """
+        Yields lookup(key) for each of an increasing stream of keys,
+        advancing through the entries instead of searching each time
+        """
+
+        index = -1
+        entries = len(self.keys)
+        for key in keys:
+            while index + 1 < entries and self.keys[index + 1] <= key:
+                index += 1
+            yield None if index < 0 else (self.files[self.file_ids[index]], self.lines[index])
+
+    def write(self, outfile):
+        outfile.write(HEADER + '\n')
+        current = None
+        for key, line, file_id in zip(self.keys, self.lines, self.file_ids):
+            if file_id != current:
+                outfile.write(f'file {self.files[file_id]}\n')
+                current = file_id
+            outfile.write(f'{key} {line}\n')
+
+    @classmethod
+    def read(cls, infile):
+        """
+        Reads a source map from an iterable of lines
+        """
+
+        source_map = cls()
+        lines = iter(infile)
+        if next(lines, '').strip() != HEADER:
+            raise ValueError('not a hack source map')
+        filename = None
+        for text in lines:
+            if text.startswith('file '):
+                filename = text[5:].rstrip('\n')
+            elif text.strip():
+                key, line = text.split()
+                source_map.add(int(key), filename, int(line))
+        return source_map
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as infile:
+            return cls.read(infile)
+
+
+def symbolize(address, rom_map, asm_map=None):
+    """
+    Describes a ROM address as asm file:line, preceded by the .vm
+    file:line the .asm line came from if asm_map is given
+    """
+
+    asm_source = rom_map.lookup(address)
+    if asm_source is None:
+        return f'ROM[{address}]'
+    description = '{}:{}'.format(*asm_source)
+    vm_source = asm_map.lookup(asm_source[1]) if asm_map else None
+    if vm_source is not None:
+        description = '{}:{} ({})'.format(*vm_source, description)
+    return description
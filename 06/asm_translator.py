@@ -1,3 +1,10 @@
+from array import array
+from collections import ChainMap
+from types import MappingProxyType
+
+from asm_sink import ListSink
+
+
 COMP_BIN = {
     '0':   '0101010',
     '1':   '0111111',
@@ -26,7 +33,14 @@ COMP_BIN = {
     'D-M': '1010011',
     'M-D': '1000111',
     'D&M': '1000000',
-    'D|M': '1010101'
+    'D|M': '1010101',
+    # commutative operand orders, as emitted by the VM translator
+    'A+D': '0000010',
+    'A&D': '0000000',
+    'A|D': '0010101',
+    'M+D': '1000010',
+    'M&D': '1000000',
+    'M|D': '1010101'
 }
 
 
@@ -54,7 +68,8 @@ JUMP_BIN = {
 }
 
 
-DEFAULT_SYMBOL_TABLE = {
+# read-only; each Translator layers its own labels and variables on top
+DEFAULT_SYMBOL_TABLE = MappingProxyType({
     'SP':     0,
     'LCL':    1,
     'ARG':    2,
@@ -78,36 +93,55 @@ DEFAULT_SYMBOL_TABLE = {
     'R15':    15,
     'SCREEN': 16384,
     'KBD':    24576
-}
+})
+
+
+# integer forms of the tables above, for packing instructions with bit operations
+COMP_CODE = {comp: int(bits, 2) for comp, bits in COMP_BIN.items()}
+DEST_CODE = {dest: int(bits, 2) for dest, bits in DEST_BIN.items()}
+JUMP_CODE = {jump: int(bits, 2) for jump, bits in JUMP_BIN.items()}
+C_PREFIX = 0b111 << 13
+
+
+# marks a buffered word as a hole for the symbol numbered by its low bits;
+# the top bit of an array('I') word, far above any 16-bit instruction
+HOLE = 1 << 31
 
 
 class Translator:
-    def __init__(self):
-        self.symbol_table = DEFAULT_SYMBOL_TABLE
-        self.translated = ''
+    def __init__(self, sink=None, source_map=None, source_name=None):
+        self.symbol_table = ChainMap({}, DEFAULT_SYMBOL_TABLE)
+        self.sink = sink if sink is not None else ListSink()
+        self.source_map = source_map
+        self.source_name = source_name
         self.next_rom_address = 0
         self.next_ram_address = 16
+        self.words = array('I')
+        self.buffered_symbols = []
+        self.buffered_symbol_ids = {}
 
-    def write_binary(self, instr_type, kwargs):
+    @property
+    def translated(self):
         """
-        Returns binarized A- and C-instructions
+        The .hack text written so far, for sinks that keep it (a
+        ListSink, or a StreamSink over an io.StringIO); a StreamSink
+        over a file raises TypeError
         """
-        
-        def convert_decimal(n):
-            return bin(n)[2:].zfill(16)
 
-        def convert_c_instruction(comp, dest, jump):
-            return '111' + COMP_BIN[comp] + DEST_BIN[dest] + JUMP_BIN[jump]
+        return self.sink.getvalue()
+
+    def encode(self, instr_type, kwargs):
+        """
+        Returns A- and C-instructions packed into an integer word
+        """
 
         if instr_type == 'c':
-            return convert_c_instruction(**kwargs)
+            return (C_PREFIX | COMP_CODE[kwargs['comp']] << 6 |
+                    DEST_CODE[kwargs['dest']] << 3 | JUMP_CODE[kwargs['jump']])
         elif instr_type == 'a-decimal':
-            dec_address = int(kwargs['value'])
-            return convert_decimal(dec_address)
+            return int(kwargs['value'])
         elif instr_type == 'a-symbol':
-            symbol = kwargs['symbol']
-            dec_address = self.symbol_table[symbol]
-            return convert_decimal(dec_address)
+            return self.symbol_table[kwargs['symbol']]
 
     def assign_label_address(self, instr_type, kwargs):
         """
@@ -118,8 +152,18 @@ class Translator:
             label = kwargs['symbol']
             self.symbol_table[label] = self.next_rom_address
         else:
+            self.map_source(kwargs)
             self.next_rom_address += 1
 
+    def map_source(self, kwargs):
+        """
+        Maps the next ROM address to the instruction's source line, for
+        instructions parsed with parse_numbered_lines
+        """
+
+        if self.source_map is not None and 'line' in kwargs:
+            self.source_map.add(self.next_rom_address, self.source_name, kwargs['line'])
+
     def assign_symbol_address(self, instr_type, kwargs):
         """
         Adds RAM addresses to symbol table if new A-instruction symbol
@@ -127,11 +171,67 @@ class Translator:
         """
         
         if instr_type == 'a-symbol':
-            symbol = kwargs['symbol']
-            if symbol not in self.symbol_table:
-                self.symbol_table[symbol] = self.next_ram_address
-                self.next_ram_address += 1
+            self.resolve_symbol(kwargs['symbol'])
 
         if instr_type != 'l':
-            hack = self.write_binary(instr_type, kwargs)
-            self.translated += hack + '\n'
+            self.sink.write(self.encode(instr_type, kwargs))
+
+    def translate(self, instr_type, kwargs):
+        """
+        Single-pass alternative to assign_label_address followed by
+        assign_symbol_address: records labels and buffers converted
+        instructions, leaving a hole for each symbolic A-instruction
+        Holes are left even for labels already seen, since a later
+        definition of the same label wins in the two-pass path
+        Holes are filled as drain yields them, once every instruction
+        has been translated
+        """
+
+        if instr_type == 'l':
+            self.assign_label_address(instr_type, kwargs)
+            return
+
+        if instr_type == 'a-symbol':
+            symbol = kwargs['symbol']
+            if symbol not in self.buffered_symbol_ids:
+                if len(self.buffered_symbols) >= HOLE:
+                    raise ValueError(f'more than {HOLE} distinct symbols to buffer')
+                self.buffered_symbol_ids[symbol] = len(self.buffered_symbols)
+                self.buffered_symbols.append(symbol)
+            self.words.append(HOLE | self.buffered_symbol_ids[symbol])
+        else:
+            word = self.encode(instr_type, kwargs)
+            if word >> 16:
+                raise ValueError(f'{kwargs} does not fit in 16 bits')
+            self.words.append(word)
+
+        self.map_source(kwargs)
+        self.next_rom_address += 1
+
+    def drain(self):
+        """
+        Yields buffered instructions in order as (word, symbol) pairs,
+        where symbol is None unless the word is a hole, and empties
+        the buffer
+        """
+
+        symbols = self.buffered_symbols
+        for word in self.words:
+            if word & HOLE:
+                yield 0, symbols[word ^ HOLE]
+            else:
+                yield word, None
+
+        self.words = array('I')
+        self.buffered_symbols = []
+        self.buffered_symbol_ids = {}
+
+    def resolve_symbol(self, symbol):
+        """
+        Returns address of symbol, allocating RAM for new variables
+        """
+
+        if symbol not in self.symbol_table:
+            self.symbol_table[symbol] = self.next_ram_address
+            self.next_ram_address += 1
+        return self.symbol_table[symbol]
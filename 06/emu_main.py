@@ -0,0 +1,119 @@
+import argparse
+import os
+import sys
+import time
+
+from hack_emulator import Emulator, read_program
+from hack_jit import JitEmulator
+from hack_profile import profile_program
+from hack_screen import HEIGHT, Screen
+from hack_threaded import ThreadedEmulator
+
+
+ENGINES = {
+    'interpreter': Emulator,
+    'threaded': ThreadedEmulator,
+    'jit': JitEmulator,
+}
+
+
+def parse_assignment(text):
+    address, value = text.split('=')
+    return int(address), int(value)
+
+
+def parse_range(text):
+    first, _, last = text.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def run_with_screen(emulator, max_cycles, every, frames=None, frame_format='pbm', show=False):
+    """
+    Runs emulator every cycles at a time, writing a frame to the frames
+    directory and/or redrawing the terminal whenever the screen changed
+    """
+
+    screen = Screen(emulator.ram)
+    cycles = 0
+    first = True
+
+    while not emulator.halted and (max_cycles is None or cycles < max_cycles):
+        cycles += emulator.run(every if max_cycles is None else min(every, max_cycles - cycles))
+        dirty = screen.update()
+        if not dirty and not first:
+            continue
+        first = False
+        if frames:
+            path = os.path.join(frames, f'frame_{emulator.cycles:010d}.{frame_format}')
+            with open(path, 'wb') as outfile:
+                outfile.write(screen.pbm() if frame_format == 'pbm' else screen.png())
+        if show:
+            sys.stdout.write(screen.terminal(dirty))
+            sys.stdout.flush()
+
+    if show:
+        sys.stdout.write(f'\x1b[{HEIGHT // 4 + 1};1H')
+    return cycles
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Hack machine emulator')
+    argparser.add_argument('path', help='.hack, .rom or .asm program')
+    argparser.add_argument('--cycles', type=int, default=None,
+                           help='stop after this many cycles (default: run until halted)')
+    argparser.add_argument('--set', nargs='*', default=[], type=parse_assignment,
+                           metavar='ADDRESS=VALUE', help='initial RAM values')
+    argparser.add_argument('--dump', nargs='*', default=[], type=parse_range,
+                           metavar='FIRST[-LAST]', help='RAM addresses to print afterwards')
+    argparser.add_argument('--engine', choices=ENGINES, default='interpreter',
+                           help='execution engine (default: interpreter)')
+    argparser.add_argument('--frames', metavar='DIR',
+                           help='write a frame to DIR whenever the screen changed')
+    argparser.add_argument('--frame-format', choices=('pbm', 'png'), default='pbm')
+    argparser.add_argument('--show', action='store_true',
+                           help='draw the screen in the terminal as it changes')
+    argparser.add_argument('--every', type=int, default=100000, metavar='CYCLES',
+                           help='cycles between screen checks (default: 100000)')
+    argparser.add_argument('--profile', type=int, nargs='?', const=20, metavar='N',
+                           help='print the N labels using most cycles (.asm only)')
+    argparser.add_argument('--vm', action='store_true',
+                           help='profile by VM function and follow calls between them')
+    argparser.add_argument('--pstats', metavar='PATH', help='write a pstats call graph profile')
+    argparser.add_argument('--speedscope', metavar='PATH', help='write a speedscope profile')
+    args = argparser.parse_args()
+
+    profiling = args.profile is not None or args.pstats or args.speedscope
+    if profiling:
+        if not args.path.endswith('.asm'):
+            argparser.error('profiling needs an .asm program for its labels')
+        emulator = profile_program(args.path, args.vm)
+    else:
+        emulator = ENGINES[args.engine](read_program(args.path))
+    for address, value in args.set:
+        emulator.ram[address] = value
+
+    start = time.perf_counter()
+    if args.frames or args.show:
+        if args.frames:
+            os.makedirs(args.frames, exist_ok=True)
+        cycles = run_with_screen(emulator, args.cycles, args.every, args.frames,
+                                 args.frame_format, args.show)
+    else:
+        cycles = emulator.run(args.cycles)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print(f'{cycles} cycles in {elapsed:.2f} s ({cycles / elapsed:,.0f} cycles/s)'
+          + (', halted' if emulator.halted else ''))
+    if isinstance(emulator, JitEmulator):
+        print(f'{emulator.compiled_cycles} cycles compiled, {emulator.interpreted_cycles} interpreted '
+              f'({emulator.compiled_fraction:.1%} compiled)')
+    if args.profile is not None:
+        for label, count in emulator.flat_profile()[:args.profile]:
+            print(f'{count:>12} {count / max(cycles, 1):7.1%}  {label}')
+    if args.pstats:
+        emulator.write_pstats(args.pstats, args.path)
+    if args.speedscope:
+        emulator.write_speedscope(args.speedscope, os.path.basename(args.path))
+    for addresses in args.dump:
+        for address in addresses:
+            print(f'RAM[{address}] = {emulator.ram[address]}')
@@ -0,0 +1,96 @@
+"""
+Batch Hack emulator
+
+Runs one program on many initial states at once. A, D, PC and RAM are
+NumPy arrays with a leading lane dimension, and every step executes
+the current instruction of every lane with array operations: the ALU is
+evaluated from the comp bits rather than per mnemonic, so lanes whose
+PCs have diverged still take the same path through the code, and
+halted lanes are masked out
+"""
+
+import numpy as np
+
+from hack_emulator import ADDRESS_MASK, RAM_SIZE, ROM_SIZE
+
+
+class BatchEmulator:
+    """
+    Lockstep emulator for lanes copies of the Hack CPU
+    ram has shape (lanes, ram_size); a smaller ram_size saves memory for
+    programs that only read and write M below it (other addresses
+    raise IndexError)
+    """
+
+    def __init__(self, program, lanes, ram_size=RAM_SIZE):
+        self.lanes = lanes
+        self.rom = np.zeros(ROM_SIZE, dtype=np.int16)
+        self.ram = np.zeros((lanes, ram_size), dtype=np.int16)
+        self.lane_index = np.arange(lanes)
+        self.load(program)
+        self.reset()
+
+    def load(self, words):
+        words = np.array([word & 0xFFFF for word in words], dtype=np.uint16)
+        if len(words) > ROM_SIZE:
+            raise ValueError(f'program of {len(words)} words does not fit in ROM')
+        self.rom[:] = 0
+        self.rom[:len(words)] = words.view(np.int16)
+
+    def reset(self):
+        self.a = np.zeros(self.lanes, dtype=np.int16)
+        self.d = np.zeros(self.lanes, dtype=np.int16)
+        self.pc = np.zeros(self.lanes, dtype=np.int32)
+        self.cycles = np.zeros(self.lanes, dtype=np.int64)
+        self.halted = np.zeros(self.lanes, dtype=bool)
+
+    def step(self):
+        """
+        Executes one instruction in every lane that has not halted
+        """
+
+        active = ~self.halted
+        lanes = self.lane_index
+        a, d, pc = self.a, self.d, self.pc
+
+        word = self.rom[pc]
+        bits = word.view(np.uint16).astype(np.int32)
+        c_instr = active & (word < 0)
+        address = a.astype(np.int32) & ADDRESS_MASK
+        reads_m = c_instr & (bits & 0x1000 != 0)
+        m = np.where(reads_m, self.ram[lanes, np.where(reads_m, address, 0)], 0)
+
+        x = np.where(bits & 0x800, 0, d).astype(np.int16)
+        x = np.where(bits & 0x400, ~x, x)
+        y = np.where(bits & 0x1000, m, a)
+        y = np.where(bits & 0x200, 0, y).astype(np.int16)
+        y = np.where(bits & 0x100, ~y, y)
+        out = np.where(bits & 0x80, x + y, x & y)
+        out = np.where(bits & 0x40, ~out, out)
+
+        write_m = c_instr & (bits & 0x8 != 0)
+        self.ram[lanes[write_m], address[write_m]] = out[write_m]
+        self.d = np.where(c_instr & (bits & 0x10 != 0), out, d)
+        self.a = np.where(c_instr & (bits & 0x20 != 0), out,
+                          np.where(active & (word >= 0), word, a))
+
+        taken = c_instr & (((bits & 0x4 != 0) & (out < 0)) |
+                           ((bits & 0x2 != 0) & (out == 0)) |
+                           ((bits & 0x1 != 0) & (out > 0)))
+        halts = (taken & (bits & 0x7 == 0x7) & (address == pc - 1) &
+                 (self.rom[address] == address))
+        self.pc = np.where(taken, address, np.where(active, pc + 1 & ADDRESS_MASK, pc))
+        self.halted |= halts
+        self.cycles += active
+
+    def run(self, max_cycles=None):
+        """
+        Steps until every lane has halted or max_cycles steps have run,
+        and returns the number of steps
+        """
+
+        steps = 0
+        while (max_cycles is None or steps < max_cycles) and not self.halted.all():
+            self.step()
+            steps += 1
+        return steps
@@ -0,0 +1,227 @@
+"""
+Hack machine emulator
+
+ROM and RAM are array('h') buffers of signed 16-bit words, the way the
+Hack CPU's ALU sees them. C-instructions are decoded through DECODE,
+a table built once from the opcode tables in asm_translator and indexed
+by instruction word
+"""
+
+import sys
+from array import array
+
+from asm_pipeline import assemble
+from asm_sink import ListSink
+from asm_translator import COMP_BIN, DEST_BIN, JUMP_BIN
+
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+ADDRESS_MASK = 0x7FFF
+
+
+def wrap(expr):
+    """
+    Wraps a Python expression so it evaluates to a signed 16-bit value
+    """
+
+    return f'((({expr}) + 0x8000 & 0xFFFF) - 0x8000)'
+
+
+def alu_expr(code):
+    """
+    Returns a Python expression over a, d and m computing what the ALU
+    outputs for a 7-bit comp code (a zx nx zy ny f no), for codes that
+    have no mnemonic in COMP_BIN
+    """
+
+    x = 'd'
+    y = 'm' if code & 0b1000000 else 'a'
+    if code & 0b100000:
+        x = '0'
+    if code & 0b10000:
+        x = f'(~{x})'
+    if code & 0b1000:
+        y = '0'
+    if code & 0b100:
+        y = f'(~{y})'
+    out = wrap(f'{x} + {y}') if code & 0b10 else f'({x} & {y})'
+    if code & 0b1:
+        out = f'(~{out})'
+    return out
+
+
+def comp_expr(comp):
+    """
+    Returns a Python expression over a, d and m for a comp mnemonic
+    """
+
+    expr = comp.lower().replace('!', '~')
+    if ('+' in expr or '-' in expr) and expr != '-1':
+        expr = wrap(expr)
+    return expr
+
+
+# Python expression computed by each of the 128 comp codes
+COMP_EXPR = {}
+for comp, bits in COMP_BIN.items():
+    COMP_EXPR.setdefault(int(bits, 2), comp_expr(comp))
+for code in range(128):
+    COMP_EXPR.setdefault(code, alu_expr(code))
+
+
+COMP_FUNC = {code: eval(f'lambda a, d, m: {expr}') for code, expr in COMP_EXPR.items()}
+
+
+# dest and jump bits, named after the tables they come from
+DEST_M = int(DEST_BIN['M'], 2)
+DEST_D = int(DEST_BIN['D'], 2)
+DEST_A = int(DEST_BIN['A'], 2)
+JUMP_LT = int(JUMP_BIN['JLT'], 2)
+JUMP_EQ = int(JUMP_BIN['JEQ'], 2)
+JUMP_GT = int(JUMP_BIN['JGT'], 2)
+JUMP_ALWAYS = int(JUMP_BIN['JMP'], 2)
+
+
+def decode(word):
+    """
+    Returns (comp function, reads M, dest bits, jump bits) for a
+    C-instruction word; bits 13 and 14 are ignored, as by the CPU
+    """
+
+    code = word >> 6 & 0b1111111
+    return COMP_FUNC[code], bool(code & 0b1000000), word >> 3 & 0b111, word & 0b111
+
+
+# Indexed by the signed instruction word; since C-instructions are
+# negative, indexing from the end of the list lands on the unsigned word
+DECODE = [None] * 0x8000 + [decode(word) for word in range(0x8000, 0x10000)]
+
+
+def read_program(path):
+    """
+    Returns the instruction words of a .hack, .rom or .asm file
+    """
+
+    if path.endswith('.rom'):
+        with open(path, 'rb') as infile:
+            words = array('H', infile.read())
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words
+
+    elif path.endswith('.asm'):
+        sink = ListSink()
+        with open(path, 'r') as infile:
+            assemble(infile, sink)
+        return sink.words
+
+    else:
+        with open(path, 'r') as infile:
+            return array('H', (int(line, 2) for line in infile if line.strip()))
+
+
+class Emulator:
+    """
+    Fetch-decode-execute interpreter for the Hack CPU
+    run stops after max_cycles, or when the program halts, i.e. jumps
+    unconditionally to an @address instruction loading its own address
+    (the (END) @END 0;JMP idiom)
+    Subclasses that set hooked are told of every executed address and
+    every taken jump through executed and jumped
+    """
+
+    hooked = False
+
+    def __init__(self, program=()):
+        self.rom = array('h', bytes(2 * ROM_SIZE))
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.reset()
+        self.load(program)
+
+    def load(self, words):
+        """
+        Loads instruction words (signed or unsigned) into ROM
+        """
+
+        words = array('H', [word & 0xFFFF for word in words])
+        if len(words) > ROM_SIZE:
+            raise ValueError(f'program of {len(words)} words does not fit in ROM')
+        self.rom[:] = array('h', bytes(2 * ROM_SIZE))
+        self.rom[:len(words)] = array('h', words.tobytes())
+        self.size = len(words)
+
+    def reset(self):
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def step(self):
+        return self.run(1)
+
+    def executed(self, pc):
+        """
+        Called before the instruction at pc executes, if hooked
+        """
+
+    def jumped(self, target, now):
+        """
+        Called when a jump to target is taken on cycle now, if hooked
+        """
+
+    def run(self, max_cycles=None):
+        """
+        Executes until halted or max_cycles have run, and returns the
+        number of cycles executed
+        """
+
+        rom = self.rom
+        ram = self.ram
+        table = DECODE
+        hooked = self.hooked
+        a, d, pc = self.a, self.d, self.pc
+        limit = sys.maxsize if max_cycles is None else max_cycles
+        cycles = 0
+
+        while cycles < limit:
+            word = rom[pc]
+            cycles += 1
+            if hooked:
+                self.executed(pc)
+
+            if word >= 0:
+                a = word
+                pc = pc + 1 & ADDRESS_MASK
+                continue
+
+            comp, reads_m, dest, jump = table[word]
+            address = a & ADDRESS_MASK
+            out = comp(a, d, ram[address] if reads_m else 0)
+
+            if dest:
+                if dest & DEST_M:
+                    ram[address] = out
+                if dest & DEST_D:
+                    d = out
+                if dest & DEST_A:
+                    a = out
+
+            if jump and (jump == JUMP_ALWAYS or
+                         jump & JUMP_LT and out < 0 or
+                         jump & JUMP_EQ and out == 0 or
+                         jump & JUMP_GT and out > 0):
+                if jump == JUMP_ALWAYS and address == pc - 1 and rom[address] == address:
+                    self.halted = True
+                    pc = address
+                    break
+                if hooked:
+                    self.jumped(address, self.cycles + cycles)
+                pc = address
+            else:
+                pc = pc + 1 & ADDRESS_MASK
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
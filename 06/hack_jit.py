@@ -0,0 +1,221 @@
+"""
+Tracing JIT for the Hack emulator
+
+Code starts out interpreted. Once the block at some address has been
+entered HOT_THRESHOLD times, the blocks executed next are recorded until
+control comes back to it (a loop) or the trace grows too long. The
+trace is then turned into one generated Python function, with a guard
+wherever execution may leave the recorded path, and cached by the ROM
+address it starts at. Loops become Python while loops, so a hot loop
+runs without returning to the dispatcher at all
+"""
+
+from collections import namedtuple
+
+from hack_emulator import ROM_SIZE, Emulator
+from hack_threaded import translate_block
+
+
+HOT_THRESHOLD = 50
+MAX_TRACE_BLOCKS = 16
+
+
+# function(ram, a, d, budget) returns (pc, a, d, cycles); a trace never
+# runs more than budget cycles, and needs at least length cycles to start
+Trace = namedtuple('Trace', ('function', 'length', 'addresses'))
+
+
+def block_exit(block, expected, cycles):
+    """
+    Returns statements leaving the trace unless block continues at
+    expected, with cycles the expression for cycles run so far
+    """
+
+    result = f'{block.a}, d, {cycles}'
+    target_known = block.target is not None and block.target.isdigit()
+
+    if block.condition is None:
+        return [] if block.fallthrough == expected else [f'return {block.fallthrough}, {result}']
+
+    lines = []
+    if block.condition == 'True':
+        taken = True
+    elif expected == block.fallthrough and not (target_known and int(block.target) == expected):
+        lines.append(f'if {block.condition}:')
+        lines.append(f'    return {block.target}, {result}')
+        taken = False
+    else:
+        lines.append(f'if not ({block.condition}):')
+        lines.append(f'    return {block.fallthrough}, {result}')
+        taken = True
+
+    if taken and not target_known:
+        lines.append(f'if {block.target} != {expected}:')
+        lines.append(f'    return {block.target}, {result}')
+    elif taken and int(block.target) != expected:
+        lines.append(f'return {block.target}, {result}')
+    return lines
+
+
+def trace_source(blocks, loops, name):
+    """
+    Returns the source of a function running the recorded blocks
+    """
+
+    length = sum(block.length for block in blocks)
+    indent = '        ' if loops else '    '
+    lines = [f'def {name}(ram, a, d, budget):', '    cycles = 0']
+    if loops:
+        lines.append('    while True:')
+
+    done = 0
+    for index, block in enumerate(blocks):
+        done += block.length
+        lines.extend(indent + statement for statement in block.body)
+        if index + 1 < len(blocks):
+            expected = blocks[index + 1].start
+        elif loops:
+            expected = blocks[0].start
+        else:
+            expected = None
+
+        if expected is None:
+            returned = f'{block.a}, d, cycles + {done}'
+            if block.condition == 'True':
+                lines.append(f'{indent}return {block.target}, {returned}')
+                continue
+            if block.condition is not None:
+                lines.append(f'{indent}if {block.condition}:')
+                lines.append(f'{indent}    return {block.target}, {returned}')
+            lines.append(f'{indent}return {block.fallthrough}, {returned}')
+            continue
+
+        lines.extend(indent + line for line in block_exit(block, expected, f'cycles + {done}'))
+        if block.a != 'a':
+            lines.append(f'{indent}a = {block.a}')
+
+    if loops:
+        lines.append(f'{indent}cycles += {length}')
+        lines.append(f'{indent}if cycles + {length} > budget:')
+        lines.append(f'{indent}    return {blocks[0].start}, a, d, cycles')
+
+    return '\n'.join(lines)
+
+
+class JitEmulator(Emulator):
+    """
+    Emulator that interprets cold code and compiles hot traces
+    compiled_cycles and interpreted_cycles count where execution
+    happened; results and cycle counts are the same as Emulator's
+    """
+
+    def __init__(self, program=(), threshold=HOT_THRESHOLD):
+        self.threshold = threshold
+        super().__init__(program)
+
+    def load(self, words):
+        super().load(words)
+        self.invalidate()
+
+    def reset(self):
+        super().reset()
+        self.compiled_cycles = 0
+        self.interpreted_cycles = 0
+
+    def invalidate(self, address=None):
+        """
+        Drops compiled traces covering address (all of them if None),
+        e.g. after the ROM has been rewritten, and restarts counting
+        """
+
+        if address is None:
+            self.traces = [None] * ROM_SIZE
+            self.counts = [0] * ROM_SIZE
+            self.lengths = {}
+            self.recording = None
+            return
+
+        for start, trace in enumerate(self.traces):
+            if trace is not None and address in trace.addresses:
+                self.traces[start] = None
+                self.counts[start] = 0
+        self.lengths = {start: length for start, length in self.lengths.items()
+                        if not start <= address < start + length}
+        self.recording = None
+
+    def write_rom(self, address, word):
+        self.rom[address] = word - 0x10000 if word > 0x7FFF else word
+        self.invalidate(address)
+
+    @property
+    def compiled_fraction(self):
+        total = self.compiled_cycles + self.interpreted_cycles
+        return self.compiled_cycles / total if total else 0.0
+
+    def block_length(self, start):
+        if start not in self.lengths:
+            self.lengths[start] = translate_block(self.rom, start).length
+        return self.lengths[start]
+
+    def compile_trace(self, starts, loops):
+        blocks = [translate_block(self.rom, start) for start in starts]
+        name = f'trace_{starts[0]}'
+        namespace = {}
+        exec(compile(trace_source(blocks, loops, name), '<hack trace>', 'exec'), namespace)
+        addresses = frozenset(address for block in blocks
+                              for address in range(block.start, block.start + block.length))
+        self.traces[starts[0]] = Trace(namespace[name], sum(block.length for block in blocks),
+                                       addresses)
+
+    def record(self, pc):
+        """
+        Extends the trace being recorded with the block at pc, compiling
+        it once it closes a loop, grows too long or runs into a trace
+        """
+
+        recording = self.recording
+        if pc == recording[0]:
+            self.compile_trace(recording, loops=True)
+        elif len(recording) >= MAX_TRACE_BLOCKS or self.traces[pc] is not None:
+            self.compile_trace(recording, loops=False)
+        else:
+            recording.append(pc)
+            return
+        self.recording = None
+
+    def run(self, max_cycles=None):
+        limit = float('inf') if max_cycles is None else max_cycles
+        cycles = 0
+        traces = self.traces
+        counts = self.counts
+        self.halted = False
+
+        while cycles < limit:
+            pc = self.pc
+            trace = traces[pc]
+
+            if trace is not None and trace.length <= limit - cycles:
+                budget = limit - cycles if max_cycles is not None else 1 << 62
+                self.pc, self.a, self.d, ran = trace.function(self.ram, self.a, self.d, budget)
+                self.cycles += ran
+                self.compiled_cycles += ran
+                cycles += ran
+                continue
+
+            if self.recording is not None:
+                self.record(pc)
+                if traces[pc] is not None and traces[pc].length <= limit - cycles:
+                    continue
+            elif trace is None:
+                counts[pc] += 1
+                if counts[pc] >= self.threshold:
+                    self.recording = [pc]
+
+            ran = super().run(min(self.block_length(pc), limit - cycles))
+            self.interpreted_cycles += ran
+            cycles += ran
+            if self.halted:
+                self.recording = None
+                break
+
+        return cycles
@@ -0,0 +1,245 @@
+"""
+Cycle profiler for Hack programs
+
+ProfilingEmulator counts how often every ROM address executes and
+attributes the counts to the nearest label at or before each address.
+Given a set of function labels (for VM-translated code, the (fn) labels
+written by write_function), it also follows calls and returns to build
+a call graph, exported in pstats or speedscope format with cycles
+standing in for seconds
+"""
+
+import json
+import marshal
+import re
+from array import array
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+from asm_parser import parse_lines
+from asm_translator import DEFAULT_SYMBOL_TABLE
+from hack_emulator import ADDRESS_MASK, ROM_SIZE, Emulator, read_program
+
+
+START = '<start>'
+
+LCL = DEFAULT_SYMBOL_TABLE['LCL']
+
+# labels made by the VM translator that are not functions:
+# fn$label for VM labels, label.N for return and comparison labels and
+# the shared routines and their labels
+VM_INTERNAL_LABEL_RE = re.compile(r'.*\$.*|label\.\d+')
+
+# the VM translator's shared call, return and comparison routines,
+# profiled as regions of their own but not as functions
+SHARED_ROUTINES = ('$CALL', '$RETURN', '$EQ', '$LT', '$GT')
+
+
+def read_labels(path):
+    """
+    Returns (address, label) pairs for the labels of an .asm file, in
+    address order
+    """
+
+    labels = []
+    address = 0
+    with open(path, 'r') as infile:
+        for instr_type, kwargs in parse_lines(infile):
+            if instr_type == 'l':
+                labels.append((address, kwargs['symbol']))
+            else:
+                address += 1
+    return labels
+
+
+def vm_functions(labels):
+    """
+    Returns the labels that name VM functions
+    """
+
+    return [(address, label) for address, label in labels
+            if not VM_INTERNAL_LABEL_RE.fullmatch(label)]
+
+
+class Frame:
+    def __init__(self, function, return_address, start):
+        self.function = function
+        self.return_address = return_address
+        self.start = start
+        self.self_cycles = 0
+
+
+class ProfilingEmulator(Emulator):
+    """
+    Interpreter keeping per-address execution counts and, when
+    functions are given, a call stack
+    A call is a taken jump to a function's address; the matching
+    return is a jump to the return address the VM call saved in the
+    new frame, at LCL - 5, whether the call was inline or through $CALL
+    """
+
+    hooked = True
+
+    def __init__(self, program=(), labels=(), functions=()):
+        self.functions = dict(functions)
+        # addresses are attributed to functions if there are any
+        if self.functions:
+            shared = [(address, label) for address, label in labels if label in SHARED_ROUTINES]
+            self.regions = sorted(list(functions) + shared)
+        else:
+            self.regions = list(labels)
+        self.region_starts = [address for address, _ in self.regions]
+        super().__init__(program)
+
+    def reset(self):
+        super().reset()
+        self.counts = array('Q', bytes(8 * ROM_SIZE))
+        self.stack = [Frame(self.enclosing(0), None, 0)]
+        self.events = [('O', self.stack[0].function, 0)]
+        self.last_event = 0
+        self.calls = Counter()
+        self.edges = defaultdict(lambda: [0, 0, 0])
+        self.self_cycles = Counter()
+        self.total_cycles = Counter()
+
+    def enclosing(self, address):
+        """
+        Returns the nearest function, or label, at or before address
+        """
+
+        index = bisect_right(self.region_starts, address)
+        return self.regions[index - 1][1] if index else START
+
+    def executed(self, pc):
+        self.counts[pc] += 1
+
+    def jumped(self, target, now):
+        """
+        Records a call or return for a jump to target
+        """
+
+        if not self.functions:
+            return
+        stack = self.stack
+        frame = stack[-1]
+        if target == frame.return_address:
+            frame.self_cycles += now - self.last_event
+            self.last_event = now
+            stack.pop()
+            self.finish_frame(frame, stack[-1].function, now)
+            self.events.append(('C', frame.function, now))
+        elif target in self.functions:
+            frame.self_cycles += now - self.last_event
+            self.last_event = now
+            function = self.functions[target]
+            return_address = self.ram[(self.ram[LCL] - 5) & ADDRESS_MASK] & ADDRESS_MASK
+            stack.append(Frame(function, return_address, now))
+            self.calls[function] += 1
+            self.events.append(('O', function, now))
+
+    def finish_frame(self, frame, caller, now):
+        elapsed = now - frame.start
+        recursive = any(outer.function == frame.function for outer in self.stack)
+        self.self_cycles[frame.function] += frame.self_cycles
+        if not recursive:
+            self.total_cycles[frame.function] += elapsed
+        edge = self.edges[caller, frame.function]
+        edge[0] += 1
+        edge[1] += frame.self_cycles
+        edge[2] += elapsed
+
+    def flat_profile(self):
+        """
+        Returns (label, cycles) pairs, most cycles first
+        """
+
+        by_label = Counter()
+        for address, count in enumerate(self.counts):
+            if count:
+                by_label[self.enclosing(address)] += count
+        return by_label.most_common()
+
+    def call_graph(self):
+        """
+        Returns calls, self cycles, total cycles and caller edges
+        ([calls, self cycles, total cycles] per (caller, callee)),
+        counting frames still open as if they returned now
+        """
+
+        calls = Counter(self.calls)
+        self_cycles = Counter(self.self_cycles)
+        total_cycles = Counter(self.total_cycles)
+        edges = defaultdict(lambda: [0, 0, 0], {key: list(value) for key, value in self.edges.items()})
+        open_functions = set()
+
+        pending = self.cycles - self.last_event
+        for depth in range(len(self.stack) - 1, -1, -1):
+            frame = self.stack[depth]
+            frame_self = frame.self_cycles + pending
+            pending = 0
+            self_cycles[frame.function] += frame_self
+            if not any(outer.function == frame.function for outer in self.stack[:depth]):
+                total_cycles[frame.function] += self.cycles - frame.start
+            open_functions.add(frame.function)
+            if depth:
+                edge = edges[self.stack[depth - 1].function, frame.function]
+                edge[0] += 1
+                edge[1] += frame_self
+                edge[2] += self.cycles - frame.start
+        calls[self.stack[0].function] += 1
+
+        return calls, self_cycles, total_cycles, edges
+
+    def write_pstats(self, path, filename='<hack>'):
+        """
+        Writes the call graph in the marshal format pstats.Stats reads
+        """
+
+        calls, self_cycles, total_cycles, edges = self.call_graph()
+        entries = {function: address for address, function in self.functions.items()}
+
+        def key(function):
+            return filename, entries.get(function, 0), function
+
+        stats = {}
+        for function in set(calls) | set(self_cycles):
+            callers = {key(caller): (edge[0], edge[0], edge[1], edge[2])
+                       for (caller, callee), edge in edges.items() if callee == function}
+            stats[key(function)] = (calls[function], calls[function], self_cycles[function],
+                                    total_cycles[function], callers)
+        with open(path, 'wb') as outfile:
+            marshal.dump(stats, outfile)
+
+    def write_speedscope(self, path, name='hack'):
+        """
+        Writes the calls and returns as a speedscope evented profile
+        """
+
+        frames = {}
+        events = []
+        for kind, function, at in self.events:
+            index = frames.setdefault(function, len(frames))
+            events.append({'type': kind, 'frame': index, 'at': at})
+        for frame in reversed(self.stack):
+            events.append({'type': 'C', 'frame': frames[frame.function], 'at': self.cycles})
+
+        document = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': [{'name': function} for function in frames]},
+            'profiles': [{'type': 'evented', 'name': name, 'unit': 'none',
+                          'startValue': 0, 'endValue': self.cycles, 'events': events}],
+            'name': name,
+            'exporter': 'hack_profile',
+        }
+        with open(path, 'w') as outfile:
+            json.dump(document, outfile)
+
+
+def profile_program(path, vm=False):
+    """
+    Returns a ProfilingEmulator loaded with the .asm file at path,
+    following calls between VM functions if vm is set
+    """
+
+    labels = read_labels(path)
+    return ProfilingEmulator(read_program(path), labels, vm_functions(labels) if vm else ())
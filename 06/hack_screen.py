@@ -0,0 +1,114 @@
+"""
+Hack screen buffer
+
+The screen is a zero-copy view of the SCREEN region of an emulator's
+RAM (an array('h') or a NumPy row): 256 rows of 32 words, each word
+holding 16 pixels with the leftmost in bit 0, 1 for black. update()
+compares the region against the previous frame and re-encodes only the
+rows that changed, so frames can be written or drawn cheaply
+"""
+
+import sys
+import zlib
+from array import array
+
+from asm_translator import DEFAULT_SYMBOL_TABLE
+
+
+SCREEN = DEFAULT_SYMBOL_TABLE['SCREEN']
+KBD = DEFAULT_SYMBOL_TABLE['KBD']
+WIDTH = 512
+HEIGHT = 256
+ROW_BYTES = WIDTH // 8
+
+# PBM wants the leftmost pixel in the high bit of each byte
+REVERSED = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+# 1-bit grayscale PNG has 0 for black
+INVERTED = bytes(0xFF ^ byte for byte in range(256))
+
+# braille dot bits for the left and right pixel of each of 4 rows
+BRAILLE_DOTS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))
+BRAILLE = [[(left if pair & 2 else 0) | (right if pair & 1 else 0) for pair in range(4)]
+           for left, right in BRAILLE_DOTS]
+
+
+def png_chunk(kind, data):
+    return (len(data).to_bytes(4, 'big') + kind + data +
+            zlib.crc32(kind + data).to_bytes(4, 'big'))
+
+
+class Screen:
+    """
+    Frame-diffing view of the Hack screen in ram
+    """
+
+    def __init__(self, ram):
+        self.region = memoryview(ram)[SCREEN:KBD].cast('B')
+        self.previous = bytearray(len(self.region))
+        self.rows = [bytes(ROW_BYTES)] * HEIGHT
+        self.drawn = False
+
+    def encode_row(self, row):
+        """
+        Returns row as PBM bits
+        """
+
+        raw = self.region[row * ROW_BYTES:(row + 1) * ROW_BYTES]
+        if sys.byteorder == 'big':
+            words = array('h', raw)
+            words.byteswap()
+            raw = words.tobytes()
+        return bytes(raw).translate(REVERSED)
+
+    def update(self):
+        """
+        Re-encodes the rows that changed since the last update and
+        returns their numbers
+        """
+
+        region = self.region
+        previous = self.previous
+        if region == previous:
+            return []
+
+        dirty = [row for row in range(HEIGHT)
+                 if region[row * ROW_BYTES:(row + 1) * ROW_BYTES] !=
+                 previous[row * ROW_BYTES:(row + 1) * ROW_BYTES]]
+        for row in dirty:
+            self.rows[row] = self.encode_row(row)
+        previous[:] = region
+        return dirty
+
+    def pbm(self):
+        return b'P4\n%d %d\n' % (WIDTH, HEIGHT) + b''.join(self.rows)
+
+    def png(self):
+        header = (WIDTH.to_bytes(4, 'big') + HEIGHT.to_bytes(4, 'big') +
+                  bytes((1, 0, 0, 0, 0)))
+        pixels = b''.join(b'\x00' + row.translate(INVERTED) for row in self.rows)
+        return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) +
+                png_chunk(b'IDAT', zlib.compress(pixels)) + png_chunk(b'IEND', b''))
+
+    def braille_line(self, line):
+        """
+        Returns text line of the screen, four pixel rows of braille cells
+        """
+
+        pairs = [[byte >> shift & 3 for byte in self.rows[row] for shift in (6, 4, 2, 0)]
+                 for row in range(4 * line, 4 * line + 4)]
+        first, second, third, fourth = BRAILLE
+        return ''.join(chr(0x2800 | first[p0] | second[p1] | third[p2] | fourth[p3])
+                       for p0, p1, p2, p3 in zip(*pairs))
+
+    def terminal(self, dirty):
+        """
+        Returns ANSI text redrawing the lines holding dirty rows, or the
+        whole screen the first time
+        """
+
+        if self.drawn:
+            lines = sorted({row // 4 for row in dirty})
+        else:
+            lines = range(HEIGHT // 4)
+            self.drawn = True
+        return ''.join(f'\x1b[{line + 1};1H{self.braille_line(line)}' for line in lines)
@@ -0,0 +1,202 @@
+"""
+Threaded-code engine for the Hack emulator
+
+The whole ROM is decoded once, when a program is loaded: every run of
+straight-line code ending in a jump becomes a single generated Python
+function that keeps A and D in locals, folds @constants into the
+instructions that use them, and returns the next PC. The run loop then
+dispatches once per block instead of once per instruction
+"""
+
+import re
+from collections import namedtuple
+
+from hack_emulator import (ADDRESS_MASK, COMP_EXPR, DEST_A, DEST_D, DEST_M,
+                           JUMP_ALWAYS, ROM_SIZE, Emulator)
+
+
+# longest block compiled into one function
+MAX_BLOCK = 256
+
+
+# Python condition on the ALU output t for each jump code
+JUMP_EXPR = {
+    0b001: 't > 0',
+    0b010: 't == 0',
+    0b011: 't >= 0',
+    0b100: 't < 0',
+    0b101: 't != 0',
+    0b110: 't <= 0',
+    0b111: 'True'
+}
+
+
+VARIABLE_RE = re.compile(r'\b([adm])\b')
+
+
+# Straight-line code from start up to and including the first jump:
+# body is a list of statements, a the expression A holds at the end,
+# condition the jump condition (None if the block does not end in a
+# jump), target the jump target and fallthrough the next PC otherwise;
+# halts is set for the (END) @END 0;JMP idiom
+BlockCode = namedtuple('BlockCode', ('start', 'length', 'body', 'a', 'condition',
+                                     'target', 'fallthrough', 'halts'))
+
+
+Block = namedtuple('Block', ('function', 'length', 'halts'))
+
+
+def substitute(expr, a, d, m):
+    """
+    Replaces the a, d and m variables in a COMP_EXPR expression
+    """
+
+    names = {'a': a, 'd': d, 'm': m}
+    return VARIABLE_RE.sub(lambda match: names[match[1]], expr)
+
+
+def translate_block(rom, start, end=ROM_SIZE):
+    """
+    Returns the BlockCode for the straight-line code at start
+    """
+
+    body = []
+    known_a = None
+    pc = start
+    condition = target = None
+    halts = False
+
+    while True:
+        word = rom[pc]
+        pc += 1
+
+        if word >= 0:
+            known_a = word
+
+        else:
+            code = word >> 6 & 0b1111111
+            dest = word >> 3 & 0b111
+            jump = word & 0b111
+
+            if known_a is None:
+                a, address = 'a', '(a & 0x7FFF)'
+            else:
+                a = address = str(known_a)
+
+            if jump and known_a is None and dest & DEST_A:
+                body.append('target = a & 0x7FFF')
+                target = 'target'
+            elif jump:
+                target = address
+            if dest & DEST_M and known_a is None and dest & DEST_A:
+                body.append('address = a & 0x7FFF')
+                address = 'address'
+
+            expr = substitute(COMP_EXPR[code], a, 'd', f'ram[{address}]')
+            if dest == DEST_D and not jump:
+                body.append(f'd = {expr}')
+            else:
+                body.append(f't = {expr}')
+                if dest & DEST_M:
+                    body.append(f'ram[{address}] = t')
+                if dest & DEST_D:
+                    body.append('d = t')
+                if dest & DEST_A:
+                    body.append('a = t')
+                    known_a = None
+
+            if jump:
+                condition = JUMP_EXPR[jump]
+                halts = (jump == JUMP_ALWAYS and target == str(pc - 2) and
+                         rom[pc - 2] == pc - 2)
+                break
+
+        if pc >= end or pc - start >= MAX_BLOCK:
+            break
+
+    final_a = 'a' if known_a is None else str(known_a)
+    return BlockCode(start, pc - start, body, final_a, condition, target,
+                     pc & ADDRESS_MASK, halts)
+
+
+def block_source(block, name):
+    """
+    Returns the source of a function running block and returning the
+    next PC with the new A and D
+    """
+
+    lines = [f'def {name}(ram, a, d):']
+    lines.extend(f'    {statement}' for statement in block.body)
+    if block.condition == 'True':
+        lines.append(f'    return {block.target}, {block.a}, d')
+    elif block.condition:
+        lines.append(f'    if {block.condition}:')
+        lines.append(f'        return {block.target}, {block.a}, d')
+    if block.condition != 'True':
+        lines.append(f'    return {block.fallthrough}, {block.a}, d')
+    return '\n'.join(lines)
+
+
+def compile_blocks(rom, starts, end=ROM_SIZE):
+    """
+    Compiles the blocks at starts with a single exec, returning a dict
+    of start address to Block
+    """
+
+    codes = [translate_block(rom, start, end) for start in starts]
+    source = '\n\n'.join(block_source(code, f'block_{code.start}') for code in codes)
+    namespace = {}
+    exec(compile(source, '<hack blocks>', 'exec'), namespace)
+    return {code.start: Block(namespace[f'block_{code.start}'], code.length, code.halts)
+            for code in codes}
+
+
+class ThreadedEmulator(Emulator):
+    """
+    Emulator that runs pre-decoded blocks
+    Blocks start at address 0 and after every jump; entering code
+    anywhere else (e.g. through a label reached by fall-through as well)
+    compiles one more block starting there on first use
+    Results and cycle counts are the same as Emulator's; when fewer
+    cycles remain than a block needs, the interpreter finishes the run
+    """
+
+    def load(self, words):
+        super().load(words)
+        end = max(self.size, 1)
+        starts = {0}
+        for pc in range(self.size):
+            word = self.rom[pc]
+            if word < 0 and word & 0b111:
+                starts.add(pc + 1 & ADDRESS_MASK)
+        self.blocks = [None] * ROM_SIZE
+        for start, block in compile_blocks(self.rom, sorted(starts), end).items():
+            self.blocks[start] = block
+
+    def compile_block(self, start):
+        block = compile_blocks(self.rom, [start])[start]
+        self.blocks[start] = block
+        return block
+
+    def run(self, max_cycles=None):
+        ram = self.ram
+        blocks = self.blocks
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+
+        while max_cycles is None or cycles < max_cycles:
+            block = blocks[pc] or self.compile_block(pc)
+            if max_cycles is not None and cycles + block.length > max_cycles:
+                self.a, self.d, self.pc = a, d, pc
+                self.cycles += cycles
+                return cycles + super().run(max_cycles - cycles)
+
+            pc, a, d = block.function(ram, a, d)
+            cycles += block.length
+            if block.halts:
+                self.halted = True
+                break
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
@@ -0,0 +1,147 @@
+"""
+Cycle benchmark for the VM translator's code generation options
+
+Each program (a .vm file or a directory of them) is translated under
+every configuration, assembled and run on the project 06 emulator until
+it halts, and the ROM words and cycles are compared to the plain
+translation. A directory with a Sys.vm (or any program, with --init)
+gets the bootstrap code; a program's .tst script, if there is one,
+supplies its initial RAM (set RAM[n] v) and the cells whose values
+must match (output-list RAM[n])
+A program that runs off the end of its code halts there
+"""
+
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '06'))
+
+from asm_pipeline import assemble_instrs
+from asm_sink import ListSink
+from hack_emulator import Emulator
+
+from vm_fusion import Fuser
+from vm_parser import Parser
+from vm_translator import Translator
+
+
+CONFIGURATIONS = [
+    ('plain', {}),
+    ('fuse', {'fuse': True}),
+    ('stack-cache', {'stack_cache': True}),
+    ('fuse+stack-cache', {'fuse': True, 'stack_cache': True}),
+    ('shared-compares', {'shared_compares': True}),
+    ('all', {'fuse': True, 'stack_cache': True, 'trampolines': True, 'shared_compares': True}),
+]
+
+SET_RAM_RE = re.compile(r'set\s+RAM\[(\d+)\]\s+(-?\d+)')
+OUTPUT_RAM_RE = re.compile(r'RAM\[(\d+)\]')
+STATIC_RE = re.compile(r'.+\.\d+')
+
+END_LABEL = 'vm_bench.end'
+
+
+def vm_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.vm'))
+    return [path]
+
+
+def read_test(path):
+    """
+    Returns the RAM assignments and the output RAM addresses of the .tst
+    script next to a program, if any
+    """
+
+    name = os.path.basename(os.path.normpath(path)).split('.vm')[0]
+    tstpath = os.path.join(path if os.path.isdir(path) else os.path.dirname(path), name + '.tst')
+    if not os.path.exists(tstpath):
+        return [], []
+    with open(tstpath, 'r') as infile:
+        text = infile.read()
+    assignments = [(int(address), int(value)) for address, value in SET_RAM_RE.findall(text)]
+    outputs = [int(address) for line in text.split(';') if 'output-list' in line
+               for address in OUTPUT_RAM_RE.findall(line)]
+    return assignments, outputs
+
+
+def translate(files, init=False, fuse=False, **options):
+    """
+    Returns the assembly instructions of files and the fusions made
+    """
+
+    translator = Translator(**options)
+    fuser = Fuser()
+    if init or any(os.path.basename(path) == 'Sys.vm' for path in files):
+        translator.write_init()
+
+    for path in files:
+        translator.set_filename(os.path.basename(path).split('.vm')[0])
+        with open(path, 'r') as infile:
+            parser = Parser(infile.readlines())
+        commands = parser.commands()
+        if fuse:
+            commands = fuser.run(commands)
+        for cmd_type, cmd, line in commands:
+            translator.translate(cmd_type, cmd, line)
+
+    translator.close()
+    end = [('l', {'symbol': END_LABEL}), ('a-symbol', {'symbol': END_LABEL}),
+           ('c', {'dest': '', 'comp': '0', 'jump': 'JMP'})]
+    return list(translator.instructions()) + end, fuser.fused
+
+
+def run(instrs, assignments, outputs, max_cycles):
+    """
+    Returns ROM words, cycles, whether the program halted and the RAM
+    values (by address, or static symbol) its results are judged by
+    """
+
+    sink = ListSink()
+    translator = assemble_instrs(instrs, sink)
+    emulator = Emulator(sink.words)
+    for address, value in assignments:
+        emulator.ram[address] = value
+    cycles = emulator.run(max_cycles)
+
+    symbols = translator.symbol_table.maps[0]
+    results = {address: emulator.ram[address] for address in outputs or [0]}
+    if not outputs:
+        results.update((symbol, emulator.ram[address]) for symbol, address in symbols.items()
+                       if STATIC_RE.fullmatch(symbol) and not symbol.startswith('label.')
+                       and address < 256)
+    return len(sink.words), cycles, emulator.halted, results
+
+
+def benchmark(path, max_cycles, init=False):
+    files = vm_files(path)
+    assignments, outputs = read_test(path)
+    print(path)
+
+    baseline = None
+    for name, options in CONFIGURATIONS:
+        instrs, fused = translate(files, init, **options)
+        words, cycles, halted, results = run(instrs, assignments, outputs, max_cycles)
+        if baseline is None:
+            baseline = words, cycles, results
+        status = 'halted' if halted else 'stopped'
+        if results != baseline[2]:
+            status += ', RESULTS DIFFER'
+        print(f'  {name:<18} {words:>7} words {words / baseline[0]:7.1%} '
+              f'{cycles:>11} cycles {cycles / max(baseline[1], 1):7.1%}  {status}'
+              + ''.join(f', {pattern} x{count}' for pattern, count in sorted(fused.items())))
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='VM translator cycle benchmark')
+    argparser.add_argument('paths', nargs='+', help='.vm files or directories of them')
+    argparser.add_argument('--cycles', type=int, default=10000000,
+                           help='stop a program after this many cycles (default: 10000000)')
+    argparser.add_argument('--init', action='store_true',
+                           help='write the bootstrap code even without a Sys.vm')
+    args = argparser.parse_args()
+
+    for path in args.paths:
+        benchmark(path, args.cycles, args.init)
@@ -0,0 +1,97 @@
+"""
+Superinstruction fusion for VM commands
+
+Sits between vm_parser and vm_translator: a window slides over the
+(cmd_type, cmd, line) commands of a file, and runs of commands matching
+one of the patterns below are replaced by a single fused command whose
+cmd is the list of the commands it stands for. The Translator emits a
+specialized sequence for each fused command type
+
+Patterns never span a label, since a label is itself a command
+"""
+
+from collections import Counter
+
+
+COMPARISONS = ('eq', 'lt', 'gt')
+
+# segments whose value can be an A or M operand without computing an address
+DIRECT_SEGMENTS = ('constant', 'static', 'temp', 'pointer')
+
+
+def is_push(cmd, segments=None):
+    return cmd[0] == 'push' and (segments is None or cmd[1] in segments)
+
+
+def match_compare_branch(cmds):
+    """
+    Returns how many commands [push x, push y,] eq/lt/gt, [not,] if-goto
+    spans at the start of cmds, or 0
+    """
+
+    index = 2 if len(cmds) > 2 and is_push(cmds[0]) and is_push(cmds[1]) else 0
+    if index < len(cmds) and cmds[index][0] in COMPARISONS:
+        index += 1
+        if index < len(cmds) and cmds[index] == ['not']:
+            index += 1
+        if index < len(cmds) and cmds[index][0] == 'if-goto':
+            return index + 1
+    return 0
+
+
+def match_push_pop(cmds):
+    return 2 if len(cmds) > 1 and is_push(cmds[0]) and cmds[1][0] == 'pop' else 0
+
+
+def match_push_arithmetic(cmds):
+    return 2 if (len(cmds) > 1 and is_push(cmds[0], DIRECT_SEGMENTS) and
+                 cmds[1][0] in ('add', 'sub', 'and', 'or')) else 0
+
+
+# tried in order at every position
+PATTERNS = [
+    ('compare-branch', match_compare_branch),
+    ('push-pop', match_push_pop),
+    ('push-arithmetic', match_push_arithmetic),
+]
+
+# longest run any pattern matches
+WINDOW = 5
+
+
+class Fuser:
+    """
+    Replaces matching runs of commands with fused commands and counts
+    how often each pattern fired
+    """
+
+    def __init__(self):
+        self.fused = Counter()
+
+    def run(self, commands):
+        """
+        Yields (cmd_type, cmd, line) for commands, fused where possible;
+        a fused command keeps the line of its first command
+        """
+
+        window = []
+        commands = iter(commands)
+        exhausted = False
+
+        while window or not exhausted:
+            while not exhausted and len(window) < WINDOW:
+                try:
+                    window.append(next(commands))
+                except StopIteration:
+                    exhausted = True
+
+            cmds = [cmd for _, cmd, _ in window]
+            for name, match in PATTERNS:
+                length = match(cmds)
+                if length:
+                    self.fused[name] += 1
+                    yield name, cmds[:length], window[0][2]
+                    del window[:length]
+                    break
+            else:
+                yield window.pop(0)
@@ -1,6 +1,7 @@
 import os
 import sys
 
+from vm_fusion import Fuser
 from vm_parser import Parser
 from vm_translator import Translator
 
@@ -21,9 +22,13 @@ if __name__ == '__main__':
 
     outpath =  outdir + '/' + outfilename + '.asm'
 
-    translator = Translator()
+    translator = Translator(trampolines='--trampolines' in sys.argv[2:],
+                            stack_cache='--stack-cache' in sys.argv[2:],
+                            shared_compares='--shared-compares' in sys.argv[2:])
 
-    if len(sys.argv) == 3 and sys.argv[2] == '--init':
+    fuser = Fuser() if '--fuse' in sys.argv[2:] else None
+
+    if '--init' in sys.argv[2:]:
         translator.write_init()
 
     for file in vmfiles:
@@ -32,13 +37,18 @@ if __name__ == '__main__':
         with open(file, 'r') as infile:
             lines = infile.readlines()
             parser = Parser(lines)
-        
-        while parser.has_more_commands():
-            cmd = parser.advance()
-            cmd_type = parser.get_cmd_type()
-            translator.translate(cmd_type, cmd)
+
+        commands = parser.commands()
+        if fuser:
+            commands = fuser.run(commands)
+        for cmd_type, cmd, line in commands:
+            translator.translate(cmd_type, cmd, line)
 
     translator.close()
 
     with open(outpath, 'w') as outfile:
-        outfile.write(translator.translation)
+        translator.write_asm(outfile)
+
+    if '--source-map' in sys.argv[2:]:
+        with open(outpath + '.map', 'w') as mapfile:
+            translator.source_map.write(mapfile)
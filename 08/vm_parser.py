@@ -6,19 +6,31 @@ class Parser:
     def __init__(self, lines):
         self.index = 0
         self.lines = []
-        for line in lines:
+        self.line_numbers = []
+        for number, line in enumerate(lines, 1):
             line = self.strip_line(line)
             if line:
                 self.lines.append(line.split())
+                self.line_numbers.append(number)
 
     def has_more_commands(self):
         return self.index < len(self.lines)
 
     def advance(self):
         self.current = self.lines[self.index]
+        self.current_line = self.line_numbers[self.index]
         self.index += 1
         return self.current
 
+    def commands(self):
+        """
+        Yields (cmd_type, cmd, line) for the remaining commands
+        """
+
+        while self.has_more_commands():
+            cmd = self.advance()
+            yield self.get_cmd_type(), cmd, self.current_line
+
     def get_cmd_type(self):
         if self.current[0] in self._ARITHMETIC_OPERATIONS:
             return 'arithmetic'
@@ -1,3 +1,25 @@
+"""
+VM translator
+
+Commands are translated into a buffer of (instr_type, kwargs) pairs in
+the form asm_parser produces, plus ('comment', cmd) entries for the
+// comment heading each command. Every snippet of assembly is a
+Template split and parsed once, at import; only its lines holding
+{fields} are formatted and parsed again when it is emitted. The buffer
+is streamed to an .asm file by write_asm, or handed to the project 06
+assembler by instructions() without going through text
+"""
+
+import os
+import sys
+from types import MappingProxyType
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '06'))
+
+from asm_parser import Parser
+from asm_source_map import SourceMap
+
+
 # we know these at runtime
 KNOWN_SEGMENTS = {
     'pointer': 3,
@@ -14,6 +36,18 @@ UNKNOWN_SEGMENTS = {
 }
 
 
+# labels of the shared call and return routines
+CALL_LABEL = '$CALL'
+RETURN_LABEL = '$RETURN'
+
+# labels of the shared comparison routines
+COMPARE_LABELS = {
+    'eq': '$EQ',
+    'lt': '$LT',
+    'gt': '$GT',
+}
+
+
 OPERANDS = {
     'add': '+',
     'sub': '-',
@@ -27,24 +61,538 @@ OPERANDS = {
 }
 
 
+# jumps taken when a comparison is false
+NEGATED_JUMPS = {
+    'eq': 'JNE',
+    'lt': 'JGE',
+    'gt': 'JLE',
+}
+
+
+def asm_line(instr_type, kwargs):
+    """
+    Returns the line of assembly for a buffered entry
+    """
+
+    if instr_type == 'c':
+        line = kwargs['comp']
+        if kwargs['dest']:
+            line = kwargs['dest'] + '=' + line
+        if kwargs['jump']:
+            line += ';' + kwargs['jump']
+        return line
+    elif instr_type == 'a-decimal':
+        return '@' + kwargs['value']
+    elif instr_type == 'a-symbol':
+        return '@' + kwargs['symbol']
+    elif instr_type == 'l':
+        return '(' + kwargs['symbol'] + ')'
+    return f'// {kwargs}'
+
+
+def freeze(instr_type, kwargs):
+    """
+    Returns the instruction with a read-only view of its kwargs
+    """
+
+    return instr_type, MappingProxyType(kwargs)
+
+
+class Template:
+    """
+    A snippet of assembly, one instruction per line, split and parsed
+    once; lines holding {fields} are parsed when filled in
+    The parsed lines are shared by every emission, so their kwargs are
+    read-only views; a stage adding to them (as parse_numbered_lines
+    adds 'line') fails instead of changing every other emission
+    """
+
+    def __init__(self, text):
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        self.instrs = [None if '{' in line else freeze(*Parser.parse_instr(line))
+                       for line in lines]
+        # (index, line) of each line holding fields
+        self.fields = [(index, line) for index, line in enumerate(lines) if '{' in line]
+
+    def fill(self, fields):
+        instrs = self.instrs[:]
+        for index, line in self.fields:
+            instrs[index] = Parser.parse_instr(line.format_map(fields))
+        return instrs
+
+
+BOOTSTRAP = Template("""
+    @256
+    D=A
+    @SP
+    M=D
+    """)
+
+LABEL = Template('({label}$label)')
+
+ARITHMETIC_TOS = Template("""
+    @SP
+    A=M-1
+    D=M
+    """)
+
+UNARY = {operator: Template(f'M={OPERANDS[operator]}D') for operator in ['neg', 'not']}
+
+BINARY = {operator: Template(f"""
+    A=A-1
+    M=M{OPERANDS[operator]}D
+    @SP
+    M=M-1
+    """) for operator in ['add', 'sub', 'and', 'or']}
+
+CACHED_LOGICAL = Template("""
+    @{true_label}
+    D;{jump}
+    D=0
+    @{done_label}
+    0;JMP
+    ({true_label})
+    D=-1
+    ({done_label})
+    """)
+
+LOGICAL = Template("""
+    @SP
+    A=M-1
+    D=M
+    @{true_label}
+    D;{jump}
+    @SP
+    A=M-1
+    M=0
+    @{done_label}
+    0;JMP
+    ({true_label})
+    @SP
+    A=M-1
+    M=-1
+    ({done_label})
+    """)
+
+LOAD_CONSTANT = Template("""
+    @{index}
+    D=A
+    """)
+
+LOAD_STATIC = Template("""
+    @{symbol}
+    D=M
+    """)
+
+LOAD_ADDRESS = Template("""
+    A=D
+    D=M
+    """)
+
+STORE = Template("""
+    @{address}
+    M=D
+    """)
+
+POP_ADDRESS_TO_R13 = Template("""
+    @R13
+    M=D
+    """)
+
+STORE_AT_R13 = Template("""
+    @R13
+    A=M
+    M=D
+    """)
+
+IF_GOTO = Template("""
+    @{label}$label
+    D;JNE
+    """)
+
+GOTO = Template("""
+    @{label}$label
+    0;JMP
+    """)
+
+LOAD_RETURN_ADDRESS = Template("""
+    @{label}
+    D=A
+    """)
+
+CALL = Template("""
+    @SP
+    D=M
+    @{offset}
+    D=D-A
+    @ARG
+    M=D
+    @SP
+    D=M
+    @LCL
+    M=D
+    @{function}
+    0;JMP
+    ({return_label})
+    """)
+
+RETURN = Template("""
+    @LCL
+    D=M
+    @FRAME
+    M=D
+    @5
+    A=D-A
+    D=M
+    @RET
+    M=D
+    @SP
+    AM=M-1
+    D=M
+    @ARG
+    A=M
+    M=D
+    @ARG
+    D=M+1
+    @SP
+    M=D
+    """)
+
+RESTORE = [Template(f"""
+    @FRAME
+    D=M
+    @{offset}
+    A=D-A
+    D=M
+    @{symbol}
+    M=D
+    """) for offset, symbol in enumerate(['THAT', 'THIS', 'ARG', 'LCL'], 1)]
+
+JUMP_TO_RET = Template("""
+    @RET
+    A=M
+    0;JMP
+    """)
+
+JUMP_TO_RETURN = Template(f"""
+    @{RETURN_LABEL}
+    0;JMP
+    """)
+
+SHARED_CALL_NARGS = {nargs: Template(f"""
+    @R13
+    M={nargs}
+    """) for nargs in (0, 1)}
+
+SHARED_CALL_MANY_ARGS = Template("""
+    @{nargs}
+    D=A
+    @R13
+    M=D
+    """)
+
+SHARED_CALL = Template(f"""
+    @{{function}}
+    D=A
+    @R14
+    M=D
+    @{{return_label}}
+    D=A
+    @R15
+    M=D
+    @{CALL_LABEL}
+    0;JMP
+    ({{return_label}})
+    """)
+
+CALL_ROUTINE_START = Template(f"""
+    ({CALL_LABEL})
+    @R15
+    D=M
+    """)
+
+LOAD_POINTER = {symbol: Template(f"""
+    @{symbol}
+    D=M
+    """) for symbol in ['LCL', 'ARG', 'THIS', 'THAT']}
+
+CALL_ROUTINE_END = Template("""
+    @R13
+    D=M
+    @5
+    D=D+A
+    @SP
+    D=M-D
+    @ARG
+    M=D
+    @SP
+    D=M
+    @LCL
+    M=D
+    @R14
+    A=M
+    0;JMP
+    """)
+
+RETURN_ROUTINE_START = Template(f"""
+    ({RETURN_LABEL})
+    @LCL
+    D=M
+    @R13
+    M=D
+    @5
+    A=D-A
+    D=M
+    @R14
+    M=D
+    @SP
+    AM=M-1
+    D=M
+    @ARG
+    A=M
+    M=D
+    @ARG
+    D=M+1
+    @SP
+    M=D
+    """)
+
+RETURN_ROUTINE_RESTORE = {symbol: Template(f"""
+    @R13
+    AM=M-1
+    D=M
+    @{symbol}
+    M=D
+    """) for symbol in ['THAT', 'THIS', 'ARG', 'LCL']}
+
+RETURN_ROUTINE_END = Template("""
+    @R14
+    A=M
+    0;JMP
+    """)
+
+FUNCTION = Template('({function})')
+
+CACHED_UNARY = {operator: Template(f'D={OPERANDS[operator]}D') for operator in ['neg', 'not']}
+
+CACHED_BINARY = {operator: Template(f"""
+    @SP
+    AM=M-1
+    D=M{OPERANDS[operator]}D
+    """) for operator in ['add', 'sub', 'and', 'or']}
+
+# *(segment pointer + index) = D, stepping A up to the index
+STORE_NEAR = {index: Template('\n'.join(['@{symbol}'] + (['A=M'] if index == 0 else
+                                                        ['A=M+1'] + ['A=A+1'] * (index - 1)) + ['M=D']))
+              for index in range(8)}
+
+STORE_FAR_VALUE = Template("""
+    @R13
+    M=D
+    """)
+
+STORE_FAR = Template("""
+    @R14
+    M=D
+    @R13
+    D=M
+    @R14
+    A=M
+    M=D
+    """)
+
+PUSH_OPERAND_TO_D = Template("""
+    @{address}
+    D=D{operand}{register}
+    """)
+
+PUSH_OPERAND_IN_PLACE = Template("""
+    @{address}
+    D={register}
+    @SP
+    A=M-1
+    M=M{operand}D
+    """)
+
+SUBTRACT_OPERAND = Template("""
+    @{address}
+    D=D-{register}
+    """)
+
+SUBTRACT_FROM_R13 = Template("""
+    @R13
+    D=D-M
+    """)
+
+SUBTRACT_FROM_STACK = Template("""
+    @SP
+    AM=M-1
+    D=M-D
+    """)
+
+BRANCH = Template("""
+    @{label}$label
+    D;{jump}
+    """)
+
+SHARED_COMPARE = Template("""
+    @{return_label}
+    D=A
+    @{routine}
+    0;JMP
+    ({return_label})
+    """)
+
+COMPARE_ROUTINE_START = Template("""
+    ({routine})
+    @R15
+    M=D
+    @SP
+    AM=M-1
+    D=M
+    @R13
+    M=D
+    @SP
+    A=M-1
+    D=M
+    """)
+
+COMPARE_ROUTINE_SIGNED = Template("""
+    @{routine}.x_negative
+    D;JLT
+    @R13
+    D=M
+    @{routine}.signs_differ
+    D;JLT
+    @{routine}.same_sign
+    0;JMP
+    ({routine}.x_negative)
+    @R13
+    D=M
+    @{routine}.signs_differ
+    D;JGE
+    ({routine}.same_sign)
+    @R13
+    D=M
+    @SP
+    A=M-1
+    D=M-D
+    @{routine}.test
+    0;JMP
+    ({routine}.signs_differ)
+    @SP
+    A=M-1
+    D=M
+    @1
+    D=D|A
+    ({routine}.test)
+    """)
+
+COMPARE_ROUTINE_END = Template("""
+    @{routine}.true
+    D;{jump}
+    @SP
+    A=M-1
+    M=0
+    @R15
+    A=M
+    0;JMP
+    ({routine}.true)
+    @SP
+    A=M-1
+    M=-1
+    @R15
+    A=M
+    0;JMP
+    """)
+
+PUSH_D = Template("""
+    @SP
+    A=M
+    M=D
+    @SP
+    M=M+1
+    """)
+
+POP_D = Template("""
+    @SP
+    AM=M-1
+    D=M
+    """)
+
+SEGMENT_ADDRESS = Template("""
+    @{symbol}
+    D=M
+    @{index}
+    D=D+A
+    """)
+
+KNOWN_ADDRESS = Template("""
+    @{address}
+    D=A
+    """)
+
+
 class Translator:
-    def __init__(self):
+    def __init__(self, trampolines=False, stack_cache=False, shared_compares=False):
         self.label_counter = -1
+        # (instr_type, kwargs) pairs and ('comment', cmd) entries
         self.translated = []
+        # calls and returns jump to shared $CALL and $RETURN routines
+        self.trampolines = trampolines
+        self.trampolines_used = False
+        # the top of the stack is kept in D between commands, and only
+        # written back (spilled) at labels, jumps, calls and returns
+        self.stack_cache = stack_cache
+        self.tos_in_d = False
+        # eq, lt and gt jump to one overflow-safe routine each
+        self.shared_compares = shared_compares
+        self.compares_used = set()
+        # first .asm line of each command to its .vm file and line
+        self.source_map = SourceMap()
 
     def set_filename(self, filename):
         self.filename = filename
 
     def close(self):
-        self.translation = '\n'.join(self.translated) + '\n'
+        self.spill()
+        if self.trampolines_used:
+            self.write_trampolines()
+        for operator in sorted(self.compares_used):
+            self.write_compare_routine(operator)
+
+    def lines(self):
+        """
+        Yields the lines of the .asm file
+        """
+
+        for instr_type, kwargs in self.translated:
+            yield asm_line(instr_type, kwargs)
+
+    def write_asm(self, outfile):
+        """
+        Writes the .asm lines through to outfile as they are rendered
+        """
+
+        outfile.writelines(line + '\n' for line in self.lines())
 
-    def write(self, instr):
-        instr = map(lambda x: x.strip(), instr.split('\n'))
-        instr = list(filter(None, instr))
-        self.translated.extend(instr)
+    def instructions(self):
+        """
+        Yields the translated instructions as asm_parser would parse
+        them from the .asm file, without the comments
+        """
 
-    def translate(self, cmd_type, cmd):
-        self.write(f'// {cmd}')
+        for instr in self.translated:
+            if instr[0] != 'comment':
+                yield instr
+
+    def emit(self, template, **fields):
+        self.translated.extend(template.fill(fields))
+
+    def translate(self, cmd_type, cmd, line=None):
+        if line is not None:
+            self.source_map.add(len(self.translated) + 1, f'{self.filename}.vm', line)
+        self.translated.append(('comment', cmd))
 
         if cmd_type == 'arithmetic':
             self.write_arithmetic(*cmd)
@@ -66,25 +614,24 @@ class Translator:
             self.write_return()
         elif cmd_type == 'function':
             self.write_function(*cmd[1:])
+        elif cmd_type == 'push-arithmetic':
+            self.write_push_arithmetic(*cmd)
+        elif cmd_type == 'push-pop':
+            self.write_push_pop(*cmd)
+        elif cmd_type == 'compare-branch':
+            self.write_compare_branch(cmd)
 
     def write_init(self):
         """
         Bootstrap/initialize VM
         """
 
-        self.write(f"""
-            @256
-            D=A
-            @SP
-            M=D
-            """)
-
+        self.emit(BOOTSTRAP)
         self.write_call('Sys.init', '0')
 
     def write_label(self, label):
-        self.write(f"""
-            ({label}$label)
-            """)
+        self.spill()
+        self.emit(LABEL, label=label)
 
     def write_arithmetic(self, operator):
         """
@@ -96,24 +643,15 @@ class Translator:
             2. SP = SP - 1
         """
 
-        operand = OPERANDS[operator]
-        self.write(f"""
-            @SP
-            A=M-1
-            D=M
-            """)
+        if self.stack_cache:
+            self.write_cached_arithmetic(operator)
+            return
 
-        if operator in ['neg', 'not']:
-            self.write(f"""
-                M={operand}D
-                """)
+        self.emit(ARITHMETIC_TOS)
+        if operator in UNARY:
+            self.emit(UNARY[operator])
         else:
-            self.write(f"""
-                A=A-1
-                M=M{operand}D
-                @SP
-                M=M-1
-                """)
+            self.emit(BINARY[operator])
 
     def write_logical(self, operator):
         """
@@ -123,56 +661,48 @@ class Translator:
         4. SP = SP - 1
         """
 
+        if self.shared_compares:
+            self.write_shared_compare(operator)
+            return
+
         self.write_arithmetic('sub')
 
         true_label = self.make_unique_label()
         done_label = self.make_unique_label()
-
-        self.write(f"""
-            @SP
-            A=M-1
-            D=M
-            @{true_label}
-            D;J{operator.upper()}
-            @SP
-            A=M-1
-            M=0
-            @{done_label}
-            0;JMP
-            ({true_label})
-            @SP
-            A=M-1
-            M=-1
-            ({done_label})
-            """)
+        jump = f'J{operator.upper()}'
+        if self.stack_cache:
+            self.emit(CACHED_LOGICAL, true_label=true_label, done_label=done_label, jump=jump)
+        else:
+            self.emit(LOGICAL, true_label=true_label, done_label=done_label, jump=jump)
 
     def write_push(self, segment, index=0):
         """
         1. D = constant or *(segment base + index)
         2. *(SP) = D
         3. SP = SP + 1
+        With the stack cached, the old top is spilled first and D
+        becomes the new top instead of being stored
         """
 
-        if segment == 'constant':
-            self.write(f"""
-                @{index}
-                D=A
-                """)
+        self.spill()
+        self.write_load_d(segment, index)
+        if self.stack_cache:
+            self.tos_in_d = True
+        else:
+            self.write_push_d()
 
-        elif segment == 'static':
-            self.write(f"""
-                @{self.filename}.{index}
-                D=M
-                """)
+    def write_load_d(self, segment, index):
+        """
+        D = constant or *(segment base + index)
+        """
 
+        if segment == 'constant':
+            self.emit(LOAD_CONSTANT, index=index)
+        elif segment == 'static':
+            self.emit(LOAD_STATIC, symbol=f'{self.filename}.{index}')
         else:
             self.get_ram_address(segment, index)
-            self.write(f"""
-                A=D
-                D=M
-                """)
-
-        self.write_push_d()
+            self.emit(LOAD_ADDRESS)
 
     def write_pop(self, segment, index):
         """
@@ -185,45 +715,38 @@ class Translator:
             3. *(R13) = D
         """
 
+        if self.stack_cache:
+            self.write_cached_pop(segment, index)
+            return
+
         if segment == 'static':
             self.write_pop_d()
-            self.write(f"""
-                @{self.filename}.{index}
-                M=D
-                """)
+            self.emit(STORE, address=f'{self.filename}.{index}')
         else:
             self.get_ram_address(segment, index)
-            self.write(f"""
-                @R13
-                M=D
-                """)
+            self.emit(POP_ADDRESS_TO_R13)
             self.write_pop_d()
-            self.write(f"""
-                @R13
-                A=M
-                M=D
-                """)
+            self.emit(STORE_AT_R13)
 
     def write_if(self, label):
         """
         If *(SP-1) != 0, jump to label
         """
 
-        self.write_pop_d()
-        self.write(f"""
-            @{label}$label
-            D;JNE
-            """)
+        if self.stack_cache:
+            self.fill()
+            self.tos_in_d = False
+        else:
+            self.write_pop_d()
+        self.emit(IF_GOTO, label=label)
 
     def write_goto(self, label):
         """
         Jump to label
         """
 
-        self.write(f"""
-            @{label}$label
-            0;JMP
-            """)
+        self.spill()
+        self.emit(GOTO, label=label)
 
     def write_call(self, fn, nargs):
         """
@@ -231,86 +754,237 @@ class Translator:
         been pushed onto the stack by the caller
         """
 
-        return_label = self.make_unique_label() 
-        self.write(f"""
-            @{return_label}
-            D=A
-            """)
+        self.spill()
+        if self.trampolines:
+            self.write_shared_call(fn, nargs)
+            return
+
+        return_label = self.make_unique_label()
+        self.emit(LOAD_RETURN_ADDRESS, label=return_label)
         self.write_push_d()
 
         for segment in ['local', 'argument', 'this', 'that']:
             self.get_ram_address(segment, '0')
             self.write_push_d()
 
-        self.write(f"""
-            @SP
-            D=M
-            @{int(nargs)+5}
-            D=D-A
-            @ARG
-            M=D
-            @SP
-            D=M
-            @LCL
-            M=D
-            @{fn}
-            0;JMP
-            ({return_label})
-            """)
+        self.emit(CALL, offset=int(nargs) + 5, function=fn, return_label=return_label)
 
     def write_return(self):
         """
         Return to the calling function
         """
 
-        self.write("""
-            @LCL
-            D=M
-            @FRAME
-            M=D
-            @5
-            A=D-A
-            D=M
-            @RET
-            M=D
-            @SP
-            AM=M-1
-            D=M
-            @ARG
-            A=M
-            M=D
-            @ARG
-            D=M+1
-            @SP
-            M=D
-            """)
-
-        for idx, symbol in enumerate(['THAT', 'THIS', 'ARG', 'LCL']):
-            self.write(f"""
-                @FRAME
-                D=M
-                @{idx+1}
-                A=D-A
-                D=M
-                @{symbol}
-                M=D
-                """)
-
-        self.write(f"""
-            @RET
-            A=M
-            0;JMP
-            """)
+        self.spill()
+        if self.trampolines:
+            self.trampolines_used = True
+            self.emit(JUMP_TO_RETURN)
+            return
+
+        self.emit(RETURN)
+        for template in RESTORE:
+            self.emit(template)
+        self.emit(JUMP_TO_RET)
+
+    def write_shared_call(self, fn, nargs):
+        """
+        1. R13 = nargs, R14 = fn, R15 = return address
+        2. Jump to $CALL, which returns into fn
+        """
+
+        self.trampolines_used = True
+        return_label = self.make_unique_label()
+        if int(nargs) in SHARED_CALL_NARGS:
+            self.emit(SHARED_CALL_NARGS[int(nargs)])
+        else:
+            self.emit(SHARED_CALL_MANY_ARGS, nargs=nargs)
+        self.emit(SHARED_CALL, function=fn, return_label=return_label)
+
+    def write_trampolines(self):
+        """
+        Shared routines every call and return jump to, emitted once
+        after the last function so nothing falls through into them
+        $CALL pushes the frame of R15 (return address), LCL, ARG, THIS
+        and THAT, points ARG at the R13 arguments and LCL at the stack,
+        and jumps to R14; $RETURN unwinds the frame, using R13 as FRAME
+        and R14 as RET
+        """
+
+        self.emit(CALL_ROUTINE_START)
+        self.write_push_d()
+        for symbol in ['LCL', 'ARG', 'THIS', 'THAT']:
+            self.emit(LOAD_POINTER[symbol])
+            self.write_push_d()
+        self.emit(CALL_ROUTINE_END)
+
+        self.emit(RETURN_ROUTINE_START)
+        for symbol in ['THAT', 'THIS', 'ARG', 'LCL']:
+            self.emit(RETURN_ROUTINE_RESTORE[symbol])
+        self.emit(RETURN_ROUTINE_END)
 
     def write_function(self, fn, nlocals):
         """
         Write function label and give room for nlocals in stack
         """
 
-        self.write(f'({fn})')
+        self.spill()
+        self.emit(FUNCTION, function=fn)
 
         for _ in range(int(nlocals)):
             self.write_push('constant', '0')
+        self.spill()
+
+    def spill(self):
+        """
+        Stores a top of stack cached in D
+        """
+
+        if self.tos_in_d:
+            self.tos_in_d = False
+            self.write_push_d()
+
+    def fill(self):
+        """
+        Pops the top of stack into D unless it is already cached there
+        """
+
+        if not self.tos_in_d:
+            self.write_pop_d()
+            self.tos_in_d = True
+
+    def write_cached_arithmetic(self, operator):
+        """
+        D = {operand} D, or D = *(SP-1) {operand} D popping *(SP-1),
+        with the result left in D as the new top
+        """
+
+        self.fill()
+        if operator in CACHED_UNARY:
+            self.emit(CACHED_UNARY[operator])
+        else:
+            self.emit(CACHED_BINARY[operator])
+
+    def write_cached_pop(self, segment, index):
+        """
+        *(segment base + index) = D, with the top of stack in D
+        Small offsets from a segment pointer are stepped in A; larger
+        ones park the value in R13 while the address goes to R14
+        """
+
+        self.fill()
+        self.tos_in_d = False
+        if segment == 'static':
+            self.emit(STORE, address=f'{self.filename}.{index}')
+        elif segment in KNOWN_SEGMENTS:
+            self.emit(STORE, address=KNOWN_SEGMENTS[segment] + int(index))
+        elif int(index) in STORE_NEAR:
+            self.emit(STORE_NEAR[int(index)], symbol=UNKNOWN_SEGMENTS[segment])
+        else:
+            self.emit(STORE_FAR_VALUE)
+            self.get_ram_address(segment, index)
+            self.emit(STORE_FAR)
+
+    def write_push_arithmetic(self, push, arithmetic):
+        """
+        push constant/static/temp/pointer x, then add, sub, and or or:
+        x is applied as the A or M operand, to D if the top of stack is
+        cached there and otherwise to *(SP-1) in place
+        """
+
+        segment, index = push[1:]
+        operand = OPERANDS[arithmetic[0]]
+        address, register = self.direct_operand(segment, index)
+        if self.tos_in_d:
+            self.emit(PUSH_OPERAND_TO_D, address=address, operand=operand, register=register)
+        else:
+            self.emit(PUSH_OPERAND_IN_PLACE, address=address, operand=operand, register=register)
+
+    def direct_operand(self, segment, index):
+        """
+        Returns what to load into A for a constant/static/temp/pointer
+        value, and whether the value is then A or M
+        """
+
+        if segment == 'constant':
+            return index, 'A'
+        elif segment == 'static':
+            return f'{self.filename}.{index}', 'M'
+        return KNOWN_SEGMENTS[segment] + int(index), 'M'
+
+    def write_push_pop(self, push, pop):
+        """
+        Moves x to y through D without touching the stack
+        """
+
+        self.spill()
+        self.write_load_d(*push[1:])
+        self.tos_in_d = True
+        self.write_cached_pop(*pop[1:])
+
+    def write_compare_branch(self, cmds):
+        """
+        [push x, push y,] eq/lt/gt, [not,] if-goto label: jumps on the
+        sign of x - y instead of making a -1/0 boolean to test
+        """
+
+        *operands, compare = [cmd for cmd in cmds if cmd[0] in ('push', 'eq', 'lt', 'gt')]
+        negate = ['not'] in cmds
+        label = cmds[-1][1]
+        jump = NEGATED_JUMPS[compare[0]] if negate else f'J{compare[0].upper()}'
+
+        if self.shared_compares:
+            # the routines' overflow-safe results, then a plain if-goto
+            for push in operands:
+                self.write_push(*push[1:])
+            self.write_logical(compare[0])
+            if negate:
+                self.write_arithmetic('not')
+            self.write_if(label)
+            return
+
+        if operands:
+            (_, x_segment, x_index), (_, y_segment, y_index) = operands
+            self.spill()
+            if y_segment in ('constant', 'static') or y_segment in KNOWN_SEGMENTS:
+                self.write_load_d(x_segment, x_index)
+                address, register = self.direct_operand(y_segment, y_index)
+                self.emit(SUBTRACT_OPERAND, address=address, register=register)
+            else:
+                self.write_load_d(y_segment, y_index)
+                self.emit(STORE_FAR_VALUE)
+                self.write_load_d(x_segment, x_index)
+                self.emit(SUBTRACT_FROM_R13)
+        else:
+            self.fill()
+            self.emit(SUBTRACT_FROM_STACK)
+
+        self.tos_in_d = False
+        self.emit(BRANCH, label=label, jump=jump)
+
+    def write_shared_compare(self, operator):
+        """
+        D = return address, then jump to the routine for operator
+        """
+
+        self.spill()
+        self.compares_used.add(operator)
+        self.emit(SHARED_COMPARE, return_label=self.make_unique_label(),
+                  routine=COMPARE_LABELS[operator])
+
+    def write_compare_routine(self, operator):
+        """
+        Shared routine replacing *(SP-2) and *(SP-1) with -1 if the
+        comparison holds and 0 if not, returning to the address in D
+        x - y cannot overflow when x and y have the same sign; when the
+        signs differ, x | 1 has the sign of x - y and is never zero
+        """
+
+        routine = COMPARE_LABELS[operator]
+        self.emit(COMPARE_ROUTINE_START, routine=routine)
+        if operator != 'eq':
+            self.emit(COMPARE_ROUTINE_SIGNED, routine=routine)
+        else:
+            self.emit(SUBTRACT_FROM_R13)
+        self.emit(COMPARE_ROUTINE_END, routine=routine, jump=f'J{operator.upper()}')
 
     def write_push_d(self):
         """
@@ -318,13 +992,7 @@ class Translator:
         2. SP = SP + 1
         """
 
-        self.write("""
-            @SP
-            A=M
-            M=D
-            @SP
-            M=M+1
-            """)
+        self.emit(PUSH_D)
 
     def write_pop_d(self):
         """
@@ -332,11 +1000,7 @@ class Translator:
         2. D = *(SP)
         """
 
-        self.write(f"""
-            @SP
-            AM=M-1
-            D=M
-            """)
+        self.emit(POP_D)
 
     def get_ram_address(self, segment, index=0):
         """
@@ -344,20 +1008,9 @@ class Translator:
         """
 
         if segment in UNKNOWN_SEGMENTS:
-            symbol = UNKNOWN_SEGMENTS[segment]
-            self.write(f"""
-                @{symbol}
-                D=M
-                @{index}
-                D=D+A
-                """)
-
+            self.emit(SEGMENT_ADDRESS, symbol=UNKNOWN_SEGMENTS[segment], index=index)
         elif segment in KNOWN_SEGMENTS:
-            base = KNOWN_SEGMENTS[segment]
-            address = base + int(index)
-            self.write(f"""
-                @{address}
-                D=A""")
+            self.emit(KNOWN_ADDRESS, address=KNOWN_SEGMENTS[segment] + int(index))
 
     def make_unique_label(self, text='label'):
         self.label_counter += 1